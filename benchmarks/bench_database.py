@@ -0,0 +1,232 @@
+"""
+Synthetic memories.db generator and micro-benchmarks for chode.database.
+
+Run from the directory that contains the chode package, e.g.:
+
+    python -m chode.benchmarks.bench_database --rows 1M --out bench_results.jsonl
+
+Each run appends one JSON line (commit, schema version, parameters and metrics)
+to --out so numbers can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import subprocess
+
+WORDS = (
+    "the a to and of you i it is that in this for on with was just lol what have not are be "
+    "game play server bot image music song chode pizza tonight tomorrow anyone know why how "
+    "good bad great nice yeah nah maybe sure please thanks discord voice channel stream build "
+    "update patch bug fix code python model prompt generate picture photo weekend work sleep"
+).split()
+
+def parse_count(text):
+    """Parses counts like 10000, 10k, 1M or 50m."""
+    text = text.strip().lower()
+    multiplier = 1
+    if text.endswith("k"):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith("m"):
+        multiplier, text = 1000000, text[:-1]
+    return int(float(text) * multiplier)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+class SyntheticWorkload:
+    """
+    Describes a population of guild channels and DM conversations with
+    Zipf-skewed activity, so a few channels get most of the traffic.
+    """
+
+    def __init__(self, guilds, channels_per_guild, dm_users, dm_share, years, seed):
+        self.rng = random.Random(seed)
+        self.dm_share = dm_share
+        self.years = years
+        self.channels = []  # (server_id as passed to store_memory, channel_id, member ids)
+        next_id = 10 ** 17
+        for _ in range(guilds):
+            guild_id = next_id
+            next_id += 1
+            members = [next_id + i for i in range(50)]
+            next_id += 50
+            for _ in range(channels_per_guild):
+                self.channels.append((guild_id, next_id, members))
+                next_id += 1
+        self.dms = []
+        for _ in range(dm_users):
+            user_id = next_id
+            self.dms.append((f"DM-{user_id}", next_id + 1, [user_id]))
+            next_id += 2
+        self.channel_weights = self._zipf_weights(len(self.channels))
+        self.dm_weights = self._zipf_weights(len(self.dms))
+
+    def _zipf_weights(self, n, exponent=1.1):
+        return [1.0 / (rank ** exponent) for rank in range(1, n + 1)]
+
+    def pick_conversation(self):
+        if self.dms and self.rng.random() < self.dm_share:
+            return self.rng.choices(self.dms, weights=self.dm_weights)[0]
+        return self.rng.choices(self.channels, weights=self.channel_weights)[0]
+
+    def message(self):
+        length = max(1, int(self.rng.expovariate(1 / 12)))
+        return " ".join(self.rng.choice(WORDS) for _ in range(length))
+
+    def rows(self, count, encode_server_id):
+        """Yields (server_id, channel_id, user_id, message, ts) rows in time order."""
+        end_ms = int(time.time() * 1000)
+        start_ms = end_ms - int(self.years * 365 * 86400000)
+        step = (end_ms - start_ms) / max(count, 1)
+        for i in range(count):
+            server_id, channel_id, members = self.pick_conversation()
+            ts = start_ms + int(i * step)
+            yield (encode_server_id(server_id), channel_id, self.rng.choice(members), self.message(), ts)
+
+def build_database(database, workload, rows, batch_size=100000):
+    """Bulk-loads synthetic history directly in the current schema."""
+    start = time.perf_counter()
+    connection = database.connect()
+    batch = []
+    loaded = 0
+    for row in workload.rows(rows, database.encode_server_id):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO memories (server_id, channel_id, user_id, message, ts) VALUES (?, ?, ?, ?, ?)", batch
+                )
+            loaded += len(batch)
+            batch = []
+            print(f"[DEBUG] Loaded {loaded}/{rows} synthetic memories.")
+    if batch:
+        with connection:
+            connection.executemany(
+                "INSERT INTO memories (server_id, channel_id, user_id, message, ts) VALUES (?, ?, ?, ?, ?)", batch
+            )
+    connection.close()
+    return time.perf_counter() - start
+
+def bench_inserts(database, workload, count):
+    """Times store_memory calls (the event-loop cost) and the end-to-end commit of the same rows."""
+    samples = []
+    start = time.perf_counter()
+    for _ in range(count):
+        server_id, channel_id, members = workload.pick_conversation()
+        user_id = workload.rng.choice(members)
+        text = workload.message()
+        call_start = time.perf_counter()
+        database.store_memory(server_id, channel_id, user_id, text)
+        samples.append(time.perf_counter() - call_start)
+    enqueued = time.perf_counter() - start
+    database.flush_memories()
+    total = time.perf_counter() - start
+    return {
+        "insert_count": count,
+        "insert_call_p50_us": round(percentile(samples, 50) * 1e6, 2),
+        "insert_call_p99_us": round(percentile(samples, 99) * 1e6, 2),
+        "insert_calls_per_s": round(count / enqueued, 1),
+        "insert_committed_per_s": round(count / total, 1),
+    }
+
+def bench_recent(database, workload, queries, limit, cold):
+    samples = []
+    for _ in range(queries):
+        server_id, channel_id, _ = workload.pick_conversation()
+        if cold:
+            database.forget_cached_conversation(database.encode_server_id(server_id), channel_id)
+        start = time.perf_counter()
+        database.get_recent_conversation(server_id, channel_id, limit=limit)
+        samples.append(time.perf_counter() - start)
+    prefix = "recent_cold" if cold else "recent_warm"
+    return {
+        f"{prefix}_p50_ms": round(percentile(samples, 50) * 1000, 4),
+        f"{prefix}_p99_ms": round(percentile(samples, 99) * 1000, 4),
+    }
+
+def file_size(path):
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chode.database against a synthetic memories.db.")
+    parser.add_argument("--rows", default="10k", help="Rows of synthetic history, e.g. 10k, 1M, 50M.")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--channels-per-guild", type=int, default=8)
+    parser.add_argument("--dm-users", type=int, default=200)
+    parser.add_argument("--dm-share", type=float, default=0.1, help="Fraction of traffic that is DMs.")
+    parser.add_argument("--years", type=float, default=3.0, help="Span of the synthetic timestamps.")
+    parser.add_argument("--inserts", type=int, default=20000, help="store_memory calls to time.")
+    parser.add_argument("--queries", type=int, default=2000, help="get_recent_conversation calls to time.")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--workdir", default=None, help="Directory for the synthetic database.")
+    parser.add_argument("--reuse", action="store_true", help="Reuse an existing synthetic database in --workdir.")
+    parser.add_argument("--out", default="bench_results.jsonl", help="JSON lines file results are appended to.")
+    args = parser.parse_args(argv)
+
+    rows = parse_count(args.rows)
+    out_path = os.path.abspath(args.out)
+    workdir = os.path.abspath(args.workdir or f"bench_db_{args.rows}")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "memories.db")
+    if os.path.exists(db_path) and not args.reuse:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    # chode.database opens memories.db relative to the working directory on import.
+    os.chdir(workdir)
+    from chode import database
+
+    workload = SyntheticWorkload(args.guilds, args.channels_per_guild, args.dm_users,
+                                 args.dm_share, args.years, args.seed)
+    result = {
+        "commit": git_commit(),
+        "date": datetime.datetime.utcnow().isoformat(),
+        "schema_version": database.SCHEMA_VERSION,
+        "params": {key: value for key, value in vars(args).items() if key not in ("out", "workdir", "reuse")},
+    }
+    existing = database.conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+    if existing < rows:
+        result["build_seconds"] = round(build_database(database, workload, rows - existing), 2)
+    result["rows"] = database.conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+    result.update(bench_inserts(database, workload, args.inserts))
+    result.update(bench_recent(database, workload, args.queries, args.limit, cold=True))
+    result.update(bench_recent(database, workload, args.queries, args.limit, cold=False))
+    database.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    result["db_bytes"] = file_size(db_path)
+    result["bytes_per_row"] = round(result["db_bytes"] / max(result["rows"], 1), 1)
+    result["writer"] = database.writer_stats()
+    result["cache"] = database.cache_stats()
+
+    with open(out_path, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    for key, value in result.items():
+        if key not in ("params", "writer", "cache"):
+            print(f"{key:>26}: {value}")
+    print(f"Results appended to {out_path}")
+    return result
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,146 @@
+"""
+Time-to-first-token for conversational prompts: the flattened single-prompt
+layout the bot used to send versus the prefix-stable chat layout from
+chode.chat_prompt. Replays one synthetic channel conversation against an
+LMStudio endpoint with each layout in turn, e.g.:
+
+    python -m chode.benchmarks.bench_ttft --url http://127.0.0.1:1234 --turns 40
+
+Backends that reuse the KV cache for a shared prompt prefix should show a
+lower time-to-first-token for the chat layout. Results are appended as one
+JSON line to --out, like bench_database.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+from chode.benchmarks.bench_database import WORDS, percentile, git_commit
+
+PERSONALITY = "You are Chode, a friendly chatbot who answers briefly and with a bit of humour."
+SERVER_INFO = "Server Name: Bench Guild, Server ID: 100000000000000001, Member Count: 1234"
+BOT_USER_ID = 1
+LEGACY_WINDOW = 10
+
+def synthetic_conversation(turns, seed):
+    """Rows (user_id, message, ts) for a channel where the bot answers every few messages."""
+    rng = random.Random(seed)
+    users = [100 + i for i in range(6)]
+    ts = int(time.time() * 1000) - turns * 60000
+    rows = []
+    for i in range(turns):
+        ts += rng.randint(5000, 90000)
+        user_id = BOT_USER_ID if i % 3 == 2 else rng.choice(users)
+        length = max(3, int(rng.expovariate(1 / 14)))
+        rows.append((user_id, " ".join(rng.choice(WORDS) for _ in range(length)), ts))
+    return rows
+
+def ordinal(n):
+    # Copy of utils.ordinal; importing chode.utils would pull in discord.
+    if 11 <= (n % 100) <= 13:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+def legacy_line(user_id, message, ts):
+    # Same text as database.format_memory_line, without opening memories.db on import.
+    day = datetime.datetime.fromtimestamp(ts / 1000, datetime.timezone.utc)
+    return f"User {user_id} at {day.strftime('%A')} the {ordinal(day.day)} of {day.strftime('%b').lower()}: {message}\n"
+
+def legacy_messages(history, row):
+    """The old layout: everything flattened into one user prompt under a generic system message."""
+    lines = "".join(legacy_line(*r) for r in (history + [row])[-LEGACY_WINDOW:])
+    prompt = (
+        f"System: {PERSONALITY}\n"
+        f"Server Info: {SERVER_INFO}\n"
+        f"Conversation History:\n{lines}\n"
+        f"User {row[0]} said: {row[1]}\nRespond as Chode:"
+    )
+    return [
+        {"role": "system", "content": "You are chode the chatbot."},
+        {"role": "user", "content": prompt}
+    ]
+
+def chat_messages(history, row):
+    from chode import chat_prompt
+    messages, _ = chat_prompt.build_chat_messages(
+        f"{PERSONALITY}\nServer Info: {SERVER_INFO}",
+        history[-chat_prompt.HISTORY_MAX_TURNS:],
+        BOT_USER_ID,
+        f"User {row[0]} said: {row[1]}",
+        channel_key=(1, 1),
+    )
+    return messages
+
+async def first_token_seconds(client, messages):
+    start = time.perf_counter()
+    stream = client.stream_chat(messages)
+    try:
+        async for _ in stream:
+            return time.perf_counter() - start
+    finally:
+        await stream.aclose()
+    return time.perf_counter() - start
+
+async def run_layout(client, rows, build):
+    from chode import chat_prompt, prompt_budget
+    chat_prompt._anchors.clear()
+    samples = []
+    tokens = []
+    for i, row in enumerate(rows):
+        if row[0] == BOT_USER_ID:
+            continue
+        messages = build(rows[:i], row)
+        tokens.append(prompt_budget.count_message_tokens(messages))
+        samples.append(await first_token_seconds(client, messages))
+    return {
+        "requests": len(samples),
+        "ttft_p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "ttft_p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "ttft_mean_ms": round(sum(samples) / max(len(samples), 1) * 1000, 1),
+        "avg_prompt_tokens": round(sum(tokens) / max(len(tokens), 1), 1),
+    }
+
+async def run(args):
+    from chode import lmstudio
+    client = lmstudio.AsyncLMStudioClient([args.url])
+    rows = synthetic_conversation(args.turns, args.seed)
+    result = {
+        "commit": git_commit(),
+        "date": datetime.datetime.utcnow().isoformat(),
+        "url": args.url,
+        "params": {"turns": args.turns, "rounds": args.rounds, "seed": args.seed},
+    }
+    try:
+        # Warm the model once so the first measured request does not pay for loading it.
+        await first_token_seconds(client, legacy_messages([], rows[0]))
+        for round_number in range(args.rounds):
+            result[f"legacy_{round_number}"] = await run_layout(client, rows, legacy_messages)
+            result[f"chat_{round_number}"] = await run_layout(client, rows, chat_messages)
+    finally:
+        await client.close()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare time-to-first-token of the legacy and chat prompt layouts.")
+    parser.add_argument("--url", default="http://127.0.0.1:1234", help="LMStudio (OpenAI-compatible) base URL.")
+    parser.add_argument("--turns", type=int, default=40, help="Messages in the synthetic conversation.")
+    parser.add_argument("--rounds", type=int, default=1, help="Times each layout is replayed.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="bench_results.jsonl", help="JSON lines file results are appended to.")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    with open(args.out, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    for key, value in result.items():
+        if key != "params":
+            print(f"{key:>12}: {value}")
+    print(f"Results appended to {args.out}")
+    return result
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
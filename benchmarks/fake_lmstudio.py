@@ -0,0 +1,115 @@
+"""
+Stand-in for LMStudio's OpenAI-compatible API, for exercising chode.lmstudio
+without a GPU box. Serves /v1/models, /v1/chat/completions (plain and
+streamed) and /v1/embeddings on one or more local ports, e.g.:
+
+    python -m chode.benchmarks.fake_lmstudio --ports 1234 1235 --fail-rate 0.1
+
+Point lmstudio.LMSTUDIO_URLS at the ports to try the backend pool.
+"""
+import sys
+import json
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+class FakeBackend:
+    """One fake server. Set down=True to make it refuse every request with a 503."""
+
+    def __init__(self, name, first_token_delay=0.05, token_delay=0.01, tokens=40, fail_rate=0.0):
+        self.name = name
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.fail_rate = fail_rate
+        self.down = False
+        self.requests = 0
+
+    def app(self):
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        return app
+
+    @web.middleware
+    async def _faults(self, request, handler):
+        self.requests += 1
+        if self.down or random.random() < self.fail_rate:
+            return web.json_response({"error": f"{self.name} unavailable"}, status=503)
+        return await handler(request)
+
+    def _words(self, prompt):
+        words = prompt.split() or ["ok"]
+        return [f"{self.name}:{words[i % len(words)]} " for i in range(self.tokens)]
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": "default", "object": "model"}]})
+
+    async def chat(self, request):
+        body = await request.json()
+        words = self._words(body["messages"][-1]["content"])
+        await asyncio.sleep(self.first_token_delay)
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_delay * len(words))
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": "".join(words)}}]})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            for word in words:
+                event = {"choices": [{"delta": {"content": word}}]}
+                await response.write(f"data: {json.dumps(event)}\n\n".encode())
+                await asyncio.sleep(self.token_delay)
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # The client stopped reading, e.g. after the first token.
+            pass
+        return response
+
+    async def embeddings(self, request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(texts):
+            rng = random.Random(text)
+            data.append({"index": index, "embedding": [rng.uniform(-1, 1) for _ in range(64)]})
+        return web.json_response({"data": data})
+
+async def start_servers(ports, **options):
+    """Starts one FakeBackend per port on the running loop. Returns [(backend, runner)]."""
+    servers = []
+    for port in ports:
+        backend = FakeBackend(f"fake{port}", **options)
+        runner = web.AppRunner(backend.app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        servers.append((backend, runner))
+    return servers
+
+async def serve_forever(ports, **options):
+    servers = await start_servers(ports, **options)
+    print(f"Fake LMStudio listening on {', '.join(f'http://127.0.0.1:{port}' for port in ports)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for _, runner in servers:
+            await runner.cleanup()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run stand-in LMStudio servers.")
+    parser.add_argument("--ports", type=int, nargs="+", default=[1234])
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="Seconds before the first token.")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens.")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per reply.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with a 503.")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve_forever(args.ports, first_token_delay=args.first_token_delay,
+                                  token_delay=args.token_delay, tokens=args.tokens, fail_rate=args.fail_rate))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
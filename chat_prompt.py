@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from chode import prompt_budget
+from chode.prompt_budget import count_tokens, count_message_tokens, fit_sections, trim_text, MESSAGE_OVERHEAD_TOKENS
+
+# Conversation prompts are sent as chat turns laid out so consecutive requests
+# in a channel share a long identical prefix the backend can reuse from its KV
+# cache: system message (personality, then server info), then history turns,
+# then one final turn with everything that changes per request.
+#
+# History starts at a per-channel anchor message instead of sliding one message
+# per request. The anchor jumps forward only once more than HISTORY_MAX_TURNS
+# messages have piled up after it, leaving the newest HISTORY_MIN_TURNS.
+HISTORY_MIN_TURNS = 10
+HISTORY_MAX_TURNS = 20
+ANCHOR_CHANNELS = 4096
+
+_anchors = OrderedDict()  # Key: (server_id, channel_id), Value: ts of the first history message sent
+_anchors_lock = threading.Lock()
+
+def history_window(channel_key, rows):
+    """Picks the history rows to send from the channel's last HISTORY_MAX_TURNS rows (oldest first)."""
+    if not rows:
+        return rows
+    with _anchors_lock:
+        anchor = _anchors.get(channel_key)
+        start = None
+        if anchor is not None and rows[0][2] <= anchor:
+            start = next((i for i, row in enumerate(rows) if row[2] >= anchor), None)
+        if start is None or len(rows) - start > HISTORY_MAX_TURNS:
+            start = max(0, len(rows) - HISTORY_MIN_TURNS)
+        _anchors[channel_key] = rows[start][2]
+        _anchors.move_to_end(channel_key)
+        while len(_anchors) > ANCHOR_CHANNELS:
+            _anchors.popitem(last=False)
+    return rows[start:]
+
+def history_turns(rows, bot_user_id):
+    """
+    Turns (user_id, message, ts) rows into alternating chat turns: the bot's own
+    messages become assistant turns, runs of other users' messages one user turn.
+    """
+    turns = []
+    for user_id, message, _ in rows:
+        if user_id == bot_user_id:
+            role, content = "assistant", message
+        else:
+            role, content = "user", f"User {user_id}: {message}"
+        if turns and turns[-1]["role"] == role:
+            turns[-1]["content"] += "\n" + content
+        else:
+            turns.append({"role": role, "content": content})
+    return turns
+
+def build_chat_messages(system_text, history_rows, bot_user_id, new_message, context_sections=(),
+                        channel_key=None, model="default"):
+    """
+    Builds the message list for a conversational reply within the model's
+    context. The system text and new message are budgeted first, then history
+    (oldest turns dropped first), then context_sections (summary, related
+    memories) by their priorities. Returns (messages, prompt_tokens).
+    """
+    limit = prompt_budget.prompt_limit(model)
+    system = trim_text(system_text, limit // 2)
+    remaining = limit - count_tokens(system) - 2 * MESSAGE_OVERHEAD_TOKENS
+    new_text = trim_text(new_message, max(remaining, 0))
+    truncated = system != system_text or new_text != new_message
+    remaining -= count_tokens(new_text)
+
+    if channel_key is not None:
+        history_rows = history_window(channel_key, history_rows)
+    turns = history_turns(history_rows, bot_user_id)
+    while turns and count_message_tokens(turns) > remaining:
+        turns.pop(0)
+        truncated = True
+    # Chat templates expect the first turn after the system message to be the user's.
+    while turns and turns[0]["role"] == "assistant":
+        turns.pop(0)
+    remaining -= count_message_tokens(turns)
+
+    context, context_truncated = fit_sections(list(context_sections), max(remaining, 0))
+    final = context + new_text
+    messages = [{"role": "system", "content": system}] + turns
+    if turns and turns[-1]["role"] == "user":
+        messages[-1] = {"role": "user", "content": turns[-1]["content"] + "\n\n" + final}
+    else:
+        messages.append({"role": "user", "content": final})
+    prompt_budget.record_prompt(truncated or context_truncated)
+    return messages, count_message_tokens(messages)
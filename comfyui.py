@@ -1,159 +1,262 @@
+import io
 import json
-import urllib.request
-import urllib.parse
 import uuid
-import websocket
-import random
 import asyncio
-import io
-import time
+import aiohttp
 import discord
+from chode import workflows
+from collections import OrderedDict
 
 SERVER_ADDRESS = "127.0.0.1:8188"
 
-def queue_prompt(prompt):
-    client_id = str(uuid.uuid4())
-    payload = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(f"http://{SERVER_ADDRESS}/prompt", data=data)
-    result = json.loads(urllib.request.urlopen(req).read())
-    return result
-
-def get_image(filename, subfolder, folder_type):
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen(f"http://{SERVER_ADDRESS}/view?{url_values}") as response:
-        return response.read()
-
-def get_history(prompt_id):
-    with urllib.request.urlopen(f"http://{SERVER_ADDRESS}/history/{prompt_id}") as response:
-        history = json.loads(response.read())
-        print(f"[DEBUG] get_history for prompt_id {prompt_id}: {history}")
-        return history
-
-def generate_and_send_images(prompt_text: str, ctx):
-    client_id = str(uuid.uuid4())
-    ws = websocket.WebSocket()
-    try:
-        ws.connect(f"ws://{SERVER_ADDRESS}/ws?clientId={client_id}")
-        print(f"[DEBUG] Connected to ComfyUI websocket with client_id {client_id}")
-    except Exception as e:
-        raise Exception(f"Failed to connect to ComfyUI websocket: {e}")
-    
-    try:
-        with open("flux.json", "r") as f:
-            workflow = json.load(f)
-        print("[DEBUG] Loaded flux.json successfully.")
-    except Exception as e:
-        ws.close()
-        raise Exception(f"Failed to load flux.json: {e}")
-    
-    if "6" in workflow and "inputs" in workflow["6"]:
-        workflow["6"]["inputs"]["text"] = prompt_text
-        print(f"[DEBUG] Updated flux.json node '6' prompt with: {prompt_text}")
-    else:
-        ws.close()
-        raise Exception("flux.json does not contain a valid prompt node '6'.")
-    
-    random_seed = random.randint(0, 2**32 - 1)
-    if "31" in workflow and "inputs" in workflow["31"]:
-        workflow["31"]["inputs"]["seed"] = random_seed
-        print(f"[DEBUG] Updated flux.json node '31' seed with: {random_seed}")
-    else:
-        print("[DEBUG] No valid seed node ('31') found in flux.json; skipping seed update.")
-    
-    try:
-        result = queue_prompt(workflow)
-        prompt_id = result.get("prompt_id")
-        if not prompt_id:
-            raise Exception("No prompt_id returned from queue_prompt")
-        print(f"[DEBUG] Prompt queued with id: {prompt_id}")
-    except Exception as e:
-        ws.close()
-        raise Exception(f"Error during image generation: {e}")
-    
-    ws.settimeout(30)
-    processed_nodes = set()
-    # We'll break the loop if no new update is received for 5 seconds.
-    last_update = time.time()
-    while True:
-        try:
-            out = ws.recv()
-            print(f"[DEBUG] Received websocket message: {out}")
-            last_update = time.time()  # update timestamp on every successful recv
-        except Exception as e:
-            print(f"[DEBUG] Websocket error or timeout: {e}")
-            # If we haven't seen an update for over 5 seconds, break the loop.
-            if time.time() - last_update > 5:
-                break
-            continue
+# Async client tuning.
+COMFYUI_POOL_SIZE = 8           # Keep-alive HTTP connections kept open to ComfyUI.
+COMFYUI_HTTP_TIMEOUT = 60       # Deadline for one HTTP request in seconds.
+COMFYUI_JOB_TIMEOUT = 600       # Deadline for a whole generation.
+COMFYUI_IDLE_TIMEOUT = 30       # Without websocket events for this long, the job's history is checked.
+COMFYUI_POLL_INTERVAL = 1       # History polling interval when the websocket is unavailable.
+
+COMFYUI_RECONNECT_MAX = 30      # Longest wait between websocket reconnect attempts.
+COMFYUI_EARLY_EVENTS = 256      # Events kept for prompts whose id has not been registered yet.
+
+class AsyncComfyUIClient:
+    """
+    asyncio client for the ComfyUI server. HTTP calls share one pooled aiohttp
+    session. One long-lived websocket, opened under the client's own
+    client_id, carries the events for every prompt the client queues; a
+    listener task routes them to per-prompt_id waiters and reconnects when
+    the socket drops. The session is bound to the loop that first uses it.
+    """
+
+    def __init__(self, server_address=SERVER_ADDRESS, pool_size=COMFYUI_POOL_SIZE):
+        self.server_address = server_address
+        self.pool_size = pool_size
+        self.client_id = str(uuid.uuid4())
+        self.loop = None
+        self._session = None
+        self._listener = None
+        self._connected = False
+        self._waiters = {}             # Key: prompt_id, Value: asyncio.Queue of events
+        self._early = OrderedDict()    # Key: prompt_id, Value: events that arrived before the waiter
+        self.reconnects = 0
+        self.queue_remaining = None
+
+    def _ensure_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self.loop is not loop:
+            self.loop = loop
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=COMFYUI_HTTP_TIMEOUT)
+            )
+            self._listener = None
+            self._connected = False
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(self._listen())
+        return self._session
+
+    async def queue_prompt(self, workflow, client_id=None):
+        payload = {"prompt": workflow, "client_id": client_id or self.client_id}
+        async with self._ensure_session().post(f"http://{self.server_address}/prompt", json=payload) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_history(self, prompt_id):
+        async with self._ensure_session().get(f"http://{self.server_address}/history/{prompt_id}") as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_image(self, filename, subfolder, folder_type):
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        async with self._ensure_session().get(f"http://{self.server_address}/view", params=params) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def _listen(self):
+        delay = 1
+        while True:
+            try:
+                async with self._session.ws_connect(
+                    f"ws://{self.server_address}/ws?clientId={self.client_id}", heartbeat=30
+                ) as ws:
+                    if self.reconnects:
+                        print("[DEBUG] ComfyUI websocket reconnected.")
+                    self._connected = True
+                    delay = 1
+                    # Events may have been missed while disconnected; make every waiter re-check.
+                    self._broadcast({"type": "reconnected", "data": {}})
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._route(json.loads(msg.data))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        # Binary frames are live previews and are ignored.
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if delay == 1:
+                    print(f"[DEBUG] ComfyUI websocket unavailable, retrying: {e}")
+            finally:
+                self._connected = False
+            self.reconnects += 1
+            self._broadcast({"type": "disconnected", "data": {}})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, COMFYUI_RECONNECT_MAX)
+
+    def _broadcast(self, event):
+        for queue in self._waiters.values():
+            queue.put_nowait(event)
+
+    def _route(self, event):
+        data = event.get("data") or {}
+        if event.get("type") == "status":
+            self.queue_remaining = data.get("status", {}).get("exec_info", {}).get("queue_remaining")
+            return
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return
+        queue = self._waiters.get(prompt_id)
+        if queue is not None:
+            queue.put_nowait(event)
+            return
+        # The event beat queue_prompt's response; hold it for the waiter.
+        self._early.setdefault(prompt_id, []).append(event)
+        while len(self._early) > COMFYUI_EARLY_EVENTS:
+            self._early.popitem(last=False)
+
+    def _register(self, prompt_id):
+        queue = asyncio.Queue()
+        for event in self._early.pop(prompt_id, []):
+            queue.put_nowait(event)
+        self._waiters[prompt_id] = queue
+        return queue
+
+    async def run_job(self, workflow, on_image=None, on_progress=None, timeout=COMFYUI_JOB_TIMEOUT):
+        """
+        Queues a workflow and waits for it to finish. As each output node
+        completes, its images are downloaded and passed to on_image(node_id,
+        data) in background tasks, so downloads and uploads overlap with the
+        rest of the job. on_progress(value, max) gets sampler progress.
+        Returns the prompt_id.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        tasks = []
+        delivered = set()
+        prompt_id = None
+
+        def deliver(node_id, output):
+            if node_id in delivered or on_image is None:
+                return
+            delivered.add(node_id)
+            for image in output.get("images", []):
+                tasks.append(loop.create_task(self._fetch_and_deliver(node_id, image, on_image)))
 
         try:
-            msg = json.loads(out)
-        except Exception as e:
-            print(f"[DEBUG] Error parsing JSON: {e}")
-            continue
-
-        # Check for queue_update messages.
-        if msg.get("type") == "queue_update" and msg.get("delta") == -1:
-            history = get_history(prompt_id)
-            outputs = history.get(prompt_id, {}).get("outputs", {})
-            for node_id, node_output in outputs.items():
-                if node_id not in processed_nodes:
-                    for image in node_output.get("images", []):
-                        try:
-                            img_data = get_image(image["filename"], image["subfolder"], image["type"])
-                            print(f"[DEBUG] Sending image for node {node_id}")
-                        except Exception as e:
-                            print(f"[DEBUG] Error downloading image for node {node_id}: {e}")
-                            continue
-                        future = asyncio.run_coroutine_threadsafe(
-                            ctx.send(
-                                content=f"{ctx.author.mention}",
-                                file=discord.File(fp=io.BytesIO(img_data), filename=f"image_{node_id}.png")
-                            ),
-                            ctx.bot.loop
-                        )
-                        try:
-                            future.result(timeout=10)
-                        except Exception as e:
-                            print(f"[DEBUG] Error sending image for node {node_id} to Discord: {e}")
-                    processed_nodes.add(node_id)
-        
-        # Optionally, if you detect a final execution message, break out.
-        if msg.get("type") == "executing":
-            data = msg.get("data", {})
-            if data.get("node") is None and data.get("prompt_id") == prompt_id:
-                print("[DEBUG] Overall execution complete message received.")
-                break
-
-        # Also, if no new message received for >5 seconds, break.
-        if time.time() - last_update > 5:
-            print("[DEBUG] No new updates received for 5 seconds, breaking loop.")
-            break
-
-    # Process any remaining nodes.
-    history = get_history(prompt_id)
-    outputs = history.get(prompt_id, {}).get("outputs", {})
-    for node_id, node_output in outputs.items():
-        if node_id not in processed_nodes:
-            for image in node_output.get("images", []):
+            result = await self.queue_prompt(workflow)
+            prompt_id = result.get("prompt_id")
+            if not prompt_id:
+                raise Exception(f"No prompt_id returned from ComfyUI: {result}")
+            print(f"[DEBUG] Prompt queued with id: {prompt_id}")
+            events = self._register(prompt_id)
+            finished = False
+            while not finished:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise Exception(f"Image generation did not finish within {timeout}s")
+                wait = COMFYUI_IDLE_TIMEOUT if self._connected else COMFYUI_POLL_INTERVAL
                 try:
-                    img_data = get_image(image["filename"], image["subfolder"], image["type"])
-                    print(f"[DEBUG] Sending final image for node {node_id}")
-                except Exception as e:
-                    print(f"[DEBUG] Error downloading image for node {node_id}: {e}")
+                    event = await asyncio.wait_for(events.get(), min(wait, remaining))
+                except asyncio.TimeoutError:
+                    finished = prompt_id in await self.get_history(prompt_id)
                     continue
-                future = asyncio.run_coroutine_threadsafe(
-                    ctx.send(
-                        content=f"{ctx.author.mention}",
-                        file=discord.File(fp=io.BytesIO(img_data), filename=f"image_{node_id}.png")
-                    ),
-                    ctx.bot.loop
-                )
-                try:
-                    future.result(timeout=10)
-                except Exception as e:
-                    print(f"[DEBUG] Error sending image for node {node_id} to Discord: {e}")
-            processed_nodes.add(node_id)
-    ws.close()
+                kind = event.get("type")
+                data = event.get("data", {})
+                if kind in ("reconnected", "disconnected"):
+                    finished = prompt_id in await self.get_history(prompt_id)
+                elif kind == "executed" and data.get("output"):
+                    deliver(data.get("node"), data["output"])
+                elif kind == "progress" and on_progress is not None:
+                    on_progress(data.get("value"), data.get("max"))
+                elif kind == "execution_error":
+                    raise Exception(f"ComfyUI execution error: {data.get('exception_message', data)}")
+                elif kind == "executing" and data.get("node") is None:
+                    print("[DEBUG] Overall execution complete message received.")
+                    finished = True
+            # Pick up any outputs whose events were missed.
+            history = await self.get_history(prompt_id)
+            for node_id, output in history.get(prompt_id, {}).get("outputs", {}).items():
+                deliver(node_id, output)
+            if tasks:
+                await asyncio.gather(*tasks)
+            return prompt_id
+        finally:
+            self._waiters.pop(prompt_id, None)
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_and_deliver(self, node_id, image, on_image):
+        try:
+            data = await self.get_image(image["filename"], image["subfolder"], image["type"])
+        except Exception as e:
+            print(f"[DEBUG] Error downloading image for node {node_id}: {e}")
+            return
+        try:
+            await on_image(node_id, data)
+        except Exception as e:
+            print(f"[DEBUG] Error delivering image for node {node_id}: {e}")
+
+    def stats(self):
+        return {
+            "connected": self._connected,
+            "reconnects": self.reconnects,
+            "waiting_jobs": len(self._waiters),
+            "queue_remaining": self.queue_remaining,
+        }
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+_client = AsyncComfyUIClient()
+
+def run_workflow_blocking(workflow, timeout=COMFYUI_JOB_TIMEOUT):
+    """Runs a workflow to completion from a worker thread, with a short-lived client on a private loop."""
+    async def run_once():
+        client = AsyncComfyUIClient()
+        try:
+            return await client.run_job(workflow, timeout=timeout)
+        finally:
+            await client.close()
+    return asyncio.run(run_once())
+
+def build_workflow(prompt_text, workflow=None, **params):
+    """Builds the job payload for a prompt from the workflow registry (flux.json unless named)."""
+    return workflows.build(workflow, prompt=prompt_text, **params)
+
+async def generate_and_send_images(prompt_text: str, ctx):
+    """Generates images for the prompt and posts each one to ctx's channel as soon as it is ready."""
+    workflow = build_workflow(prompt_text)
+
+    async def send_image(node_id, img_data):
+        print(f"[DEBUG] Sending image for node {node_id}")
+        await ctx.send(
+            content=f"{ctx.author.mention}",
+            file=discord.File(fp=io.BytesIO(img_data), filename=f"image_{node_id}.png")
+        )
+
+    try:
+        await _client.run_job(workflow, on_image=send_image)
+    except Exception as e:
+        raise Exception(f"Error during image generation: {e}")
+
+async def close_client():
+    await _client.close()
+
+def comfyui_stats():
+    """Returns the shared websocket's connection state, reconnect count and jobs waiting on it."""
+    return _client.stats()
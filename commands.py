@@ -1,15 +1,155 @@
+import json
 import asyncio
 import discord
 from discord.ext import commands
-from chode import config, database, lmstudio, comfyui, music, utils
+from chode import (config, database, lmstudio, image_queue, music, utils, semantic, search, summarizer,
+                   prompt_budget, chat_prompt, fast_path, retention, response_cache, llm_scheduler,
+                   reactions, warmup, comfyui, workflows)
+from chode.prompt_budget import Section
+
+# Stream conversational replies into Discord as they are generated.
+STREAM_REPLIES = True
+
+# Metrics posted by !!stats, one section per component.
+STATS_SOURCES = [
+    ("Memory writer", database.writer_stats),
+    ("Conversation cache", database.cache_stats),
+    ("Retention", retention.retention_stats),
+    ("Semantic recall", semantic.semantic_stats),
+    ("Summaries", summarizer.summarizer_stats),
+    ("LLM scheduler", llm_scheduler.scheduler_stats),
+    ("LMStudio backends", lmstudio.backend_stats),
+    ("LMStudio circuit breaker", lmstudio.breaker_stats),
+    ("Response cache", response_cache.cache_stats),
+    ("Prompts", prompt_budget.prompt_stats),
+    ("Fast path", fast_path.fast_path_stats),
+    ("Reactions", reactions.reaction_stats),
+    ("Warmup", warmup.warmup_stats),
+    ("ComfyUI", comfyui.comfyui_stats),
+    ("Workflows", workflows.workflow_stats),
+    ("Image queue", image_queue.image_queue_stats),
+]
+
+def stats_messages(limit=2000):
+    """Formats every STATS_SOURCES section as a JSON block, packed into messages of at most `limit` chars."""
+    messages = []
+    current = ""
+    for name, source in STATS_SOURCES:
+        try:
+            body = json.dumps(source(), indent=1, default=str)
+        except Exception as e:
+            body = f"error: {e}"
+        header = f"**{name}**\n```json\n"
+        body = body[:limit - len(header) - 5]
+        block = f"{header}{body}\n```\n"
+        if current and len(current) + len(block) > limit:
+            messages.append(current)
+            current = ""
+        current += block
+    if current:
+        messages.append(current)
+    return messages
+
+def recall_channel_ids(message):
+    """
+    Channels whose messages may be quoted in a reply posted in message.channel:
+    that channel, plus the ones both the author and @everyone can read, so a
+    private channel's messages never end up in a reply somewhere else.
+    """
+    if message.guild is None:
+        return {message.channel.id}
+    everyone = message.guild.default_role
+    channel_ids = {message.channel.id}
+    for channel in list(message.guild.channels) + list(message.guild.threads):
+        if (channel.permissions_for(message.author).read_message_history
+                and channel.permissions_for(everyone).read_message_history):
+            channel_ids.add(channel.id)
+    return channel_ids
+
+async def recall_related_memories(server_id, text, sent_lines, channel_ids):
+    """
+    Collects older messages from channel_ids related to the text and not already
+    in sent_lines: semantic matches, or keyword matches when there are none.
+    """
+    related = await semantic.recall(server_id, text, exclude=sent_lines, channel_ids=channel_ids)
+    if related:
+        # Keyword search scans every matching row; only pay for it when semantic recall found nothing.
+        return related
+    return await asyncio.to_thread(
+        search.keyword_context, server_id, text, exclude=sent_lines, channel_ids=channel_ids
+    )
+
+async def _timed_stream(chunks, prompt_tokens, started):
+    loop = asyncio.get_running_loop()
+    first_token = None
+    async for chunk in chunks:
+        if first_token is None:
+            first_token = loop.time() - started
+        yield chunk
+    total = loop.time() - started
+    prompt_budget.record_reply(prompt_tokens, total if first_token is None else first_token, total)
+
+async def reply_history(server_id, message):
+    """
+    Returns (rows, sent_lines): the history rows chat_prompt sends as turns for
+    this message, and those rows plus the message itself as memory lines, which
+    recalled memories must not repeat.
+    """
+    rows = await database.get_recent_messages_async(server_id, message.channel.id,
+                                                    limit=chat_prompt.HISTORY_MAX_TURNS + 1)
+    current = []
+    # The message was stored before the reply is built; it goes in the final turn instead.
+    if rows and rows[-1][0] == message.author.id and rows[-1][1] == message.content:
+        rows, current = rows[:-1], rows[-1:]
+    channel_key = (database.encode_server_id(server_id), message.channel.id)
+    rows = chat_prompt.history_window(channel_key, rows[-chat_prompt.HISTORY_MAX_TURNS:])
+    sent_lines = "".join(database.format_memory_line(*row) for row in rows + current)
+    return rows, sent_lines
+
+async def send_llm_reply(channel, messages, prompt_tokens=None, remember=None):
+    """
+    Generates a reply to a list of chat messages and posts it, streaming it into
+    the channel when STREAM_REPLIES is set. With remember=(server_id, bot_user_id)
+    the reply is stored as a memory so later prompts see it as an assistant turn.
+    """
+    if prompt_tokens is None:
+        prompt_tokens = prompt_budget.count_message_tokens(messages)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    async with channel.typing():
+        if STREAM_REPLIES:
+            response_text = await utils.send_streamed_message(
+                channel,
+                _timed_stream(lmstudio.stream_chat_async(messages), prompt_tokens, started)
+            )
+        else:
+            response_text = await lmstudio.chat_async(messages)
+            elapsed = loop.time() - started
+            prompt_budget.record_reply(prompt_tokens, elapsed, elapsed)
+            if len(response_text) > 2000:
+                await utils.send_long_message(channel, response_text)
+            else:
+                await channel.send(response_text)
+    if remember is not None and response_text.strip() and not lmstudio.is_error_reply(response_text):
+        database.store_memory(remember[0], channel.id, remember[1], response_text)
 
 def setup_commands(bot):
     @bot.command(name="chodehelp")
     async def chodehelp(ctx):
         content = utils.read_whatsnew()
-        # Use a default system message for help.
-        system_message = "Return the following text exactly as is, without any modifications."
-        response_text = await asyncio.to_thread(lmstudio.call_lmstudio, content + "\n\n" + system_message)
+        guild_id = ctx.guild.id if ctx.guild else None
+        if not fast_path.use_llm(guild_id):
+            # The help text is sent as is; the model was only asked to echo it.
+            fast_path.record("chodehelp", llm=False)
+            response_text = content
+        else:
+            fast_path.record("chodehelp", llm=True)
+            # Use a default system message for help.
+            system_message = "Return the following text exactly as is, without any modifications."
+            # The reply only changes when whatsnew.txt does, so it is served from the response cache.
+            response_text = await lmstudio.call_lmstudio_async(
+                content + "\n\n" + system_message, cacheable=True, temperature=0
+            )
         if len(response_text) > 2000:
             await utils.send_long_message(ctx.channel, response_text)
         else:
@@ -25,22 +165,66 @@ def setup_commands(bot):
         else:
             await ctx.send("You do not have permission to use this command here.")
 
+    @bot.command(name="stats")
+    async def stats(ctx):
+        if not await bot.is_owner(ctx.author):
+            await ctx.send("You do not have permission to use this command here.")
+            return
+        for text in stats_messages():
+            await ctx.send(text)
+
+    @bot.command(name="whatsaid")
+    async def whatsaid(ctx, member: discord.Member, *, topic: str):
+        if not ctx.guild:
+            await ctx.send("This command only works in a server.")
+            return
+        # Only channels the caller can read; filtering in the query keeps paging consistent.
+        readable = {
+            channel.id for channel in list(ctx.guild.channels) + list(ctx.guild.threads)
+            if channel.permissions_for(ctx.author).read_message_history
+        }
+        results = await asyncio.to_thread(search.search_memories, topic, ctx.guild.id, user_id=member.id,
+                                          channel_ids=readable)
+        if not results:
+            await ctx.send(f"I don't remember {member.display_name} saying anything about that.")
+            return
+        lines = [f"{utils.format_timestamp(r['ts'])}: {r['message']}" for r in results]
+        response_text = f"Here's what {member.display_name} said about {topic}:\n" + "\n".join(lines)
+        if len(response_text) > 2000:
+            await utils.send_long_message(ctx.channel, response_text)
+        else:
+            await ctx.send(response_text)
+
     @bot.command(name="genimg")
     async def genimg(ctx, *, prompt: str):
         final_prompt = prompt
         if prompt.strip().endswith("++"):
             await ctx.send("Hold on while I reword your prompt...")
             final_prompt = prompt.strip()[:-2].strip()
-            final_prompt = utils.reword_prompt(final_prompt)
+            final_prompt = await utils.reword_prompt_async(final_prompt)
         elif "make this prompt better" in prompt.lower():
-            final_prompt = utils.reword_prompt(prompt)
+            final_prompt = await utils.reword_prompt_async(prompt)
         await ctx.send(f"Image generation started. Prompt used: {final_prompt}")
         try:
-            await asyncio.to_thread(comfyui.generate_and_send_images, final_prompt, ctx)
+            await image_queue.generate(ctx, final_prompt)
+        except image_queue.JobCancelled:
+            pass
+        except image_queue.ImageQueueFull as e:
+            await ctx.send(str(e))
         except Exception as e:
             await ctx.send(f"Error generating image: {e}")
             print(f"[DEBUG] Error in genimg command: {e}")
 
+    @bot.command(name="cancelimg")
+    async def cancelimg(ctx, job_id: int = None):
+        cancelled = image_queue.cancel(ctx.author.id, job_id)
+        if cancelled:
+            await ctx.send(f"Cancelled {cancelled} queued image job{'s' if cancelled != 1 else ''}.")
+        elif job_id is not None:
+            await ctx.send(f"You have no queued image job #{job_id}; jobs already generating cannot be cancelled.")
+        else:
+            await ctx.send("You have no queued image jobs.")
+
     @bot.command(name="play")
     async def play(ctx, *, query: str):
         if not ctx.author.voice:
@@ -83,6 +267,11 @@ def setup_commands(bot):
     async def stop_song(ctx):
         await music.stop_command(ctx)
 
+    @bot.event
+    async def on_ready():
+        # Route LMStudio calls made from worker threads through the bot's loop and scheduler.
+        lmstudio.attach_to_running_loop()
+
     @bot.event
     async def on_reaction_add(reaction, user):
         if user.bot:
@@ -123,6 +312,7 @@ def setup_commands(bot):
 
         # Store the message in the database.
         database.store_memory(server_id, message.channel.id, message.author.id, message.content)
+        summarizer.note_message(server_id, message.channel.id)
 
         # Process commands if the message starts with the command prefix.
         if message.content.startswith("!!"):
@@ -134,19 +324,23 @@ def setup_commands(bot):
             # Remove any bot mention from content.
             cleaned_content = message.clean_content.replace(bot.user.mention, "").strip()
             member_info = utils.get_member_info(message.author) if hasattr(utils, "get_member_info") else ""
-            conversation_history = database.get_recent_conversation(server_id, message.channel.id)
-            prompt_for_llm = (
-                f"System: {personality}\n"
-                f"Conversation History:\n{conversation_history}\n"
-                f"User {message.author.name} (Status: {member_info}) said: {cleaned_content}\n"
-                f"Respond as Chode:"
+            history_rows, sent_lines = await reply_history(server_id, message)
+            summary = await asyncio.to_thread(summarizer.get_summary, server_id, message.channel.id)
+            summary_section = f"Summary Of Earlier Conversation:\n{summary}\n" if summary else ""
+            related_memories = await recall_related_memories(server_id, cleaned_content, sent_lines,
+                                                             recall_channel_ids(message))
+            memories_section = f"Related Earlier Messages:\n{related_memories}\n" if related_memories else ""
+            # Personality as the system message and history as chat turns keep the
+            # prompt prefix identical between replies; what changes goes last.
+            messages, prompt_tokens = chat_prompt.build_chat_messages(
+                personality,
+                history_rows,
+                bot.user.id,
+                f"User {message.author.id} ({message.author.name}, status: {member_info}) said: {cleaned_content}",
+                context_sections=[Section(summary_section, 3), Section(memories_section, 4)],
+                model=lmstudio.CHAT_MODEL,
             )
-            async with message.channel.typing():
-                response_text = await asyncio.to_thread(lmstudio.call_lmstudio, prompt_for_llm)
-            if len(response_text) > 2000:
-                await utils.send_long_message(message.channel, response_text)
-            else:
-                await message.channel.send(response_text)
+            await send_llm_reply(message.channel, messages, prompt_tokens, remember=(server_id, bot.user.id))
             # Also process DM commands.
             await bot.process_commands(message)
             return
@@ -155,12 +349,20 @@ def setup_commands(bot):
         if bot.user in message.mentions:
             content_lower = message.content.lower()
             ctx_obj = await bot.get_context(message)
+            intent = fast_path.match_intent(content_lower)
             # If asking what a user is playing, filter out the bot's own mention.
-            if "what is" in content_lower and "playing" in content_lower:
+            if intent == "member_playing":
                 members = [m for m in message.mentions if m != bot.user]
                 if members and hasattr(utils, "get_member_info"):
                     member_info = utils.get_member_info(members[0])
-                    await message.channel.send(member_info)
+                    if fast_path.use_llm(message.guild.id):
+                        fast_path.record(intent, llm=True)
+                        await send_llm_reply(message.channel, [
+                            {"role": "system", "content": personality},
+                            {"role": "user", "content": f"Tell the user this in your own words as Chode: {member_info}"},
+                        ])
+                    else:
+                        await message.channel.send(fast_path.render(intent, message.guild.id, info=member_info))
                     return
 
             # For image generation when the bot is mentioned.
@@ -170,37 +372,61 @@ def setup_commands(bot):
                 if new_prompt.strip().endswith("++"):
                     await message.channel.send("Hold on while I reword your prompt...")
                     final_prompt = new_prompt.strip()[:-2].strip()
-                    final_prompt = utils.reword_prompt(final_prompt)
+                    final_prompt = await utils.reword_prompt_async(final_prompt)
                 elif "make this prompt better" in new_prompt.lower():
-                    final_prompt = utils.reword_prompt(new_prompt)
+                    final_prompt = await utils.reword_prompt_async(new_prompt)
                 await message.channel.send(f"Image generation started. Prompt used: {final_prompt}")
-                await asyncio.to_thread(comfyui.generate_and_send_images, final_prompt, ctx_obj)
+                try:
+                    await image_queue.generate(ctx_obj, final_prompt)
+                except image_queue.JobCancelled:
+                    pass
+                except image_queue.ImageQueueFull as e:
+                    await message.channel.send(str(e))
                 return
-            elif "what server" in content_lower:
-                prompt_for_llm = (
-                    f"System: {personality}\n"
-                    f"The user asked: '{message.content}'. The server details are as follows: "
-                    f"Name: {message.guild.name}, ID: {message.guild.id}, and there are {message.guild.member_count} members. "
-                    f"Respond in your own words as Chode."
-                )
+            elif intent == "server_info" and not fast_path.use_llm(message.guild.id):
+                await message.channel.send(fast_path.render(
+                    intent, message.guild.id,
+                    name=message.guild.name, id=message.guild.id, member_count=message.guild.member_count
+                ))
+                return
+            elif intent == "server_info":
+                fast_path.record(intent, llm=True)
+                messages = [
+                    {"role": "system", "content": personality},
+                    {"role": "user", "content": (
+                        f"The user asked: '{message.content}'. The server details are as follows: "
+                        f"Name: {message.guild.name}, ID: {message.guild.id}, and there are {message.guild.member_count} members. "
+                        f"Respond in your own words as Chode."
+                    )},
+                ]
             else:
-                conversation_history = database.get_recent_conversation(message.guild.id, message.channel.id)
+                history_rows, sent_lines = await reply_history(message.guild.id, message)
+                summary = await asyncio.to_thread(summarizer.get_summary, message.guild.id, message.channel.id)
+                summary_section = f"Summary Of Earlier Conversation:\n{summary}\n" if summary else ""
+                # Only fields that rarely change go in the system message so its prefix stays
+                # cacheable; the member count moves with every join and rides in the last turn.
                 server_info = (
-                    f"Server Name: {message.guild.name}, Server ID: {message.guild.id}, Member Count: {message.guild.member_count}"
+                    f"Server Name: {message.guild.name}, Server ID: {message.guild.id}, "
+                    f"Owner ID: {message.guild.owner_id}"
                 )
                 # Remove the bot's mention from the content.
                 cleaned_content = message.clean_content.replace(bot.user.mention, "").strip()
-                prompt_for_llm = (
-                    f"System: {personality}\n"
-                    f"Server Info: {server_info}\nConversation History:\n{conversation_history}\n"
-                    f"User {message.author.name} said: {cleaned_content}\nRespond as Chode:"
+                related_memories = await recall_related_memories(message.guild.id, cleaned_content, sent_lines,
+                                                                 recall_channel_ids(message))
+                memories_section = f"Related Earlier Messages:\n{related_memories}\n" if related_memories else ""
+                messages, prompt_tokens = chat_prompt.build_chat_messages(
+                    f"{personality}\nServer Info: {server_info}",
+                    history_rows,
+                    bot.user.id,
+                    f"Member Count: {message.guild.member_count}\n"
+                    f"User {message.author.id} ({message.author.name}) said: {cleaned_content}",
+                    context_sections=[Section(summary_section, 3), Section(memories_section, 4)],
+                    model=lmstudio.CHAT_MODEL,
                 )
-            async with message.channel.typing():
-                response_text = await asyncio.to_thread(lmstudio.call_lmstudio, prompt_for_llm)
-            if len(response_text) > 2000:
-                await utils.send_long_message(message.channel, response_text)
-            else:
-                await message.channel.send(response_text)
+                await send_llm_reply(message.channel, messages, prompt_tokens,
+                                     remember=(message.guild.id, bot.user.id))
+                return
+            await send_llm_reply(message.channel, messages)
             return
 
         # For any other guild message, process commands and add a reaction if interesting.
@@ -1,19 +1,168 @@
+import os
+import copy
+import glob
 import json
+import time
+import sqlite3
+import tempfile
+import threading
+
+# "files" keeps one config_<server_id>.json per guild (the original layout);
+# "sqlite" keeps every guild's config in a single configs.db, which scales to
+# thousands of guilds. Existing JSON files are imported into an empty configs.db.
+CONFIG_BACKEND = "files"
+CONFIG_DIR = "."
+CONFIG_DB_PATH = "configs.db"
+CONFIG_WATCH_INTERVAL = 10  # Seconds between checks for configs changed outside the bot.
+
+class FileConfigBackend:
+    """One JSON file per guild. A file's mtime is its version."""
+
+    def _path(self, server_id):
+        return os.path.join(CONFIG_DIR, f"config_{server_id}.json")
+
+    def versions(self):
+        versions = {}
+        for path in glob.glob(os.path.join(CONFIG_DIR, "config_*.json")):
+            server_id = os.path.basename(path)[len("config_"):-len(".json")]
+            try:
+                versions[server_id] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return versions
+
+    def load(self, server_id):
+        path = self._path(server_id)
+        with open(path, "r") as f:
+            config = json.load(f)
+        return config, os.stat(path).st_mtime_ns
+
+    def save(self, server_id, config):
+        # Write to a temp file in the same directory and rename it over the old one,
+        # so readers never see a half-written config.
+        path = self._path(server_id)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".config_{server_id}.", suffix=".tmp", dir=CONFIG_DIR)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.stat(path).st_mtime_ns
+
+class SqliteConfigBackend:
+    """All guild configs in one SQLite table. A row's updated_ns is its version."""
+
+    def __init__(self, path=CONFIG_DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS server_configs (
+                server_id TEXT PRIMARY KEY,
+                config TEXT NOT NULL,
+                updated_ns INTEGER NOT NULL
+            )
+            ''')
+        if self.conn.execute("SELECT COUNT(*) FROM server_configs").fetchone()[0] == 0:
+            self._import_files()
+
+    def _import_files(self):
+        files = FileConfigBackend()
+        for server_id in files.versions():
+            try:
+                config, _ = files.load(server_id)
+            except Exception as e:
+                print(f"[DEBUG] Could not import config_{server_id}.json: {e}")
+                continue
+            self.save(server_id, config)
+
+    def versions(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT server_id, updated_ns FROM server_configs").fetchall())
+
+    def load(self, server_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT config, updated_ns FROM server_configs WHERE server_id=?", (server_id,)
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(server_id)
+        return json.loads(row[0]), row[1]
+
+    def save(self, server_id, config):
+        version = time.time_ns()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO server_configs (server_id, config, updated_ns) VALUES (?, ?, ?)",
+                (server_id, json.dumps(config), version)
+            )
+        return version
+
+_backend = SqliteConfigBackend() if CONFIG_BACKEND == "sqlite" else FileConfigBackend()
+_cache = {}  # Key: server_id as str, Value: (config, version, generation)
+_cache_lock = threading.Lock()
+_generation = 0  # Bumped on every save so a refresh never forgets a config saved while it ran.
+
+def refresh_configs():
+    """Reloads configs whose version changed on disk and forgets deleted ones."""
+    started_at = _generation
+    versions = _backend.versions()
+    for server_id, version in versions.items():
+        cached = _cache.get(server_id)
+        if cached is not None and cached[1] == version:
+            continue
+        try:
+            config, version = _backend.load(server_id)
+        except Exception as e:
+            print(f"[DEBUG] Could not load config for server {server_id}: {e}")
+            continue
+        with _cache_lock:
+            _cache[server_id] = (config, version, started_at)
+    with _cache_lock:
+        for server_id, cached in list(_cache.items()):
+            if server_id not in versions and cached[2] <= started_at:
+                del _cache[server_id]
 
 def load_server_config(server_id):
     """
-    Loads the server configuration from a JSON file named 'config_<server_id>.json'.
-    If the file doesn't exist, returns an empty dictionary.
+    Returns a copy of the server's configuration from the in-process cache.
+    If the server has no configuration, returns an empty dictionary.
     """
-    try:
-        with open(f"config_{server_id}.json", "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
+    cached = _cache.get(str(server_id))
+    if cached is None:
         return {}
+    return copy.deepcopy(cached[0])
 
 def save_server_config(server_id, config):
     """
-    Saves the server configuration to a JSON file named 'config_<server_id>.json'.
+    Saves the server configuration atomically and updates the cache.
     """
-    with open(f"config_{server_id}.json", "w") as f:
-        json.dump(config, f, indent=4)
+    global _generation
+    server_id = str(server_id)
+    with _cache_lock:
+        _generation += 1
+        generation = _generation
+    version = _backend.save(server_id, config)
+    with _cache_lock:
+        _cache[server_id] = (copy.deepcopy(config), version, generation)
+
+def _watch_loop():
+    while True:
+        time.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            refresh_configs()
+        except Exception as e:
+            print(f"[DEBUG] Error refreshing server configs: {e}")
+
+def start_config_watcher():
+    """Starts the background thread that picks up configs edited outside the bot."""
+    thread = threading.Thread(target=_watch_loop, name="config-watcher", daemon=True)
+    thread.start()
+    return thread
+
+refresh_configs()
@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict, deque, Counter
+
+# Hard limits for the in-memory conversation cache.
+CACHE_MAX_CHANNELS = 2048
+CACHE_LINES_PER_CHANNEL = 50
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Rough per-line bookkeeping cost (deque slot, tuple, str headers) added to the text length.
+_LINE_OVERHEAD = 120
+
+def _entry_size(entry):
+    return len(entry[1]) + len(entry[3]) + _LINE_OVERHEAD
+
+def merge_entries(*sources):
+    """
+    Concatenates entry lists that can overlap (e.g. rows read from disk and rows
+    still queued for writing), keeping each (user_id, message, ts) as many times
+    as the source listing it most often.
+    """
+    merged = []
+    counts = Counter()
+    for source in sources:
+        seen = Counter()
+        for entry in source:
+            row = entry[:3]
+            seen[row] += 1
+            if seen[row] > counts[row]:
+                counts[row] += 1
+                merged.append(entry)
+    return merged
+
+class ConversationCache:
+    """
+    LRU-bounded set of per-channel ring buffers of history entries. Each entry
+    is (user_id, message, ts, line), where line is the already formatted
+    "User <id> at <date>: <message>\\n".
+    A channel only accepts appended lines once it has been warmed from the
+    database, so a cached buffer is always a contiguous tail of the channel.
+    Lines appended while a channel is being read are collected for begin_warm()
+    callers and merged in by warm(), so a read off the event loop misses nothing.
+    """
+
+    def __init__(self, max_channels=CACHE_MAX_CHANNELS, lines_per_channel=CACHE_LINES_PER_CHANNEL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.max_channels = max_channels
+        self.lines_per_channel = lines_per_channel
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()  # Key: (server_id, channel_id), Value: [deque of entries, size, complete]
+        self._lock = threading.Lock()
+        self._warming = {}  # Key: (server_id, channel_id), Value: lists collecting entries for in-flight reads
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _tail(self, key, limit):
+        entry = self._buffers.get(key)
+        if entry is None or (len(entry[0]) < limit and not entry[2]):
+            self.misses += 1
+            return None
+        self._buffers.move_to_end(key)
+        self.hits += 1
+        entries = entry[0]
+        if limit >= len(entries):
+            return entries
+        return list(entries)[-limit:]
+
+    def get(self, key, limit):
+        """Returns the last `limit` lines joined, or None if the channel has to be read from disk."""
+        with self._lock:
+            entries = self._tail(key, limit)
+            if entries is None:
+                return None
+            return "".join(entry[3] for entry in entries)
+
+    def get_rows(self, key, limit):
+        """Returns the last `limit` (user_id, message, ts) rows, or None if the channel has to be read from disk."""
+        with self._lock:
+            entries = self._tail(key, limit)
+            if entries is None:
+                return None
+            return [entry[:3] for entry in entries]
+
+    def begin_warm(self, key):
+        """Starts collecting entries appended to a channel; call before reading it and pass the result to warm()."""
+        with self._lock:
+            appended = []
+            self._warming.setdefault(key, []).append(appended)
+            return appended
+
+    def end_warm(self, key, appended):
+        """Stops collecting for a begin_warm() whose read failed."""
+        with self._lock:
+            self._stop_collecting(key, appended)
+
+    def _stop_collecting(self, key, appended):
+        collectors = self._warming.get(key)
+        if collectors is None:
+            return
+        collectors[:] = [c for c in collectors if c is not appended]
+        if not collectors:
+            del self._warming[key]
+
+    def warm(self, key, entries, complete, appended=None):
+        """
+        Installs a buffer for a channel from a database read and returns the
+        entries installed. `complete` means the entries are the channel's entire
+        history; `appended` is the list begin_warm() returned, if any.
+        """
+        with self._lock:
+            if appended is not None:
+                self._stop_collecting(key, appended)
+                entries = merge_entries(entries, appended)
+            old = self._buffers.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            buffer = deque(entries[-self.lines_per_channel:], maxlen=self.lines_per_channel)
+            size = sum(_entry_size(entry) for entry in buffer)
+            self._buffers[key] = [buffer, size, complete and len(entries) <= self.lines_per_channel]
+            self.bytes += size
+            self._evict()
+            return entries
+
+    def append(self, key, entry):
+        """Adds a new entry to a warm channel; cold channels are left for the next read to warm."""
+        with self._lock:
+            for appended in self._warming.get(key, ()):
+                appended.append(entry)
+            buffered = self._buffers.get(key)
+            if buffered is None:
+                return
+            buffer = buffered[0]
+            if len(buffer) == buffer.maxlen:
+                dropped = _entry_size(buffer[0])
+                buffered[1] -= dropped
+                self.bytes -= dropped
+                # The buffer no longer holds the channel's oldest message.
+                buffered[2] = False
+            buffer.append(entry)
+            buffered[1] += _entry_size(entry)
+            self.bytes += _entry_size(entry)
+            self._buffers.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key=None):
+        """Drops one channel's buffer, or every buffer when no key is given."""
+        with self._lock:
+            if key is None:
+                self._buffers.clear()
+                self.bytes = 0
+                return
+            entry = self._buffers.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def _evict(self):
+        while self._buffers and (len(self._buffers) > self.max_channels or self.bytes > self.max_bytes):
+            _, entry = self._buffers.popitem(last=False)
+            self.bytes -= entry[1]
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "channels": len(self._buffers),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,36 +1,463 @@
+import os
 import sqlite3
-import datetime
+import queue
+import threading
+from collections import deque
+import time
+import atexit
+import asyncio
 from chode.utils import format_timestamp
+from chode.conversation_cache import ConversationCache, CACHE_LINES_PER_CHANNEL, merge_entries
 
-conn = sqlite3.connect("memories.db")
+DB_PATH = "memories.db"
+
+# Write-behind tuning: queued memories are group-committed in one transaction
+# once WRITE_BATCH_SIZE rows are waiting or WRITE_FLUSH_INTERVAL seconds have
+# passed since the first one arrived, whichever comes first.
+WRITE_BATCH_SIZE = 200
+WRITE_FLUSH_INTERVAL = 0.25
+WRITE_QUEUE_MAXSIZE = 10000
+# A batch whose commit fails (e.g. "database is locked" while retention holds the
+# write lock) is retried this many times with exponential backoff before it is dropped.
+WRITE_COMMIT_RETRIES = 5
+WRITE_RETRY_BACKOFF = 0.1
+
+# Switching an existing database to incremental auto_vacuum needs a full VACUUM,
+# which locks memories.db for as long as it takes to rewrite the file. It only
+# runs at startup when CHODE_VACUUM_CONVERT=1 is set; new databases get the mode
+# for free when they are created.
+VACUUM_CONVERT_ON_START = os.getenv("CHODE_VACUUM_CONVERT") == "1"
+
+def connect(path=DB_PATH):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # Takes effect on a new file (it must precede WAL mode and the first table);
+    # an existing one keeps its mode until a full VACUUM.
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL only syncs at checkpoints, which is safe against corruption.
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+# Schema history, tracked with PRAGMA user_version:
+#   1 - original layout: TEXT ids and ISO-8601 timestamp strings, no index.
+#   2 - INTEGER ids, epoch-millisecond ts and a composite (server_id, channel_id, ts)
+#       index. DM conversations ("DM-<user id>") are stored with a negative server_id
+#       so they can never collide with a guild id.
+#   3 - auto_vacuum=INCREMENTAL requested so space freed by retention can be returned
+#       to the OS. Only new files get it at once; see VACUUM_CONVERT_ON_START.
+#   4 - memories_fts, an FTS5 external-content index over memories.message kept in
+#       sync by triggers, backfilled in chunks for existing rows.
+#   5 - summaries: one rolling conversation summary per channel.
+#   6 - memories_fts_vocab, an fts5vocab view of memories_fts giving per-term document
+#       counts so keyword recall can skip terms too common to rank by.
+SCHEMA_VERSION = 6
+MIGRATION_CHUNK_SIZE = 50000
+
+def encode_server_id(server_id):
+    """Maps a guild id or a "DM-<user id>" identifier to the integer stored in the database."""
+    if isinstance(server_id, str) and server_id.startswith("DM-"):
+        return -int(server_id[3:])
+    return int(server_id)
+
+def _migrate_to_v1(connection):
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS memories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        server_id TEXT,
+        channel_id TEXT,
+        user_id TEXT,
+        message TEXT,
+        timestamp TEXT
+    )
+    ''')
+
+def _migrate_to_v2(connection):
+    # Rows are copied in id order, one short transaction per chunk, so other
+    # connections are never locked out for long. An interrupted migration
+    # resumes from the last id already copied.
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS memories_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        server_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        message TEXT,
+        ts INTEGER NOT NULL
+    )
+    ''')
+    last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM memories_v2").fetchone()[0]
+    copied = 0
+    while True:
+        with connection:
+            cur = connection.execute(
+                '''
+                INSERT INTO memories_v2 (id, server_id, channel_id, user_id, message, ts)
+                SELECT id,
+                       CASE WHEN server_id LIKE 'DM-%' THEN -CAST(substr(server_id, 4) AS INTEGER)
+                            ELSE CAST(server_id AS INTEGER) END,
+                       CAST(channel_id AS INTEGER),
+                       CAST(user_id AS INTEGER),
+                       message,
+                       CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)
+                FROM memories WHERE id > ? ORDER BY id LIMIT ?
+                ''',
+                (last_id, MIGRATION_CHUNK_SIZE)
+            )
+        if cur.rowcount <= 0:
+            break
+        copied += cur.rowcount
+        last_id = connection.execute("SELECT MAX(id) FROM memories_v2").fetchone()[0]
+        print(f"[DEBUG] Migrated {copied} memories to schema v2 (up to id {last_id}).")
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("DROP TABLE memories")
+    connection.execute("ALTER TABLE memories_v2 RENAME TO memories")
+    connection.execute("CREATE INDEX IF NOT EXISTS memories_recent_idx ON memories (server_id, channel_id, ts)")
+
+def _migrate_to_v3(connection):
+    # connect() already requests the mode; an existing file only switches with a full
+    # VACUUM, which migrate() leaves to VACUUM_CONVERT_ON_START.
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+def convert_to_incremental_vacuum(connection):
+    """
+    Rewrites the database with a full VACUUM so incremental auto_vacuum takes
+    effect. Holds an exclusive lock for the whole rewrite; run it before the
+    writer thread starts.
+    """
+    connection.commit()
+    start = time.perf_counter()
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+    print(f"[DEBUG] Converted memories.db to incremental auto_vacuum in {time.perf_counter() - start:.1f}s.")
+
+def _migrate_to_v4(connection):
+    connection.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+        message,
+        content='memories',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''')
+    connection.execute('''
+    CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts (rowid, message) VALUES (new.id, new.message);
+    END
+    ''')
+    connection.execute('''
+    CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+        INSERT INTO memories_fts (memories_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END
+    ''')
+    connection.execute('''
+    CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF message ON memories BEGIN
+        INSERT INTO memories_fts (memories_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO memories_fts (rowid, message) VALUES (new.id, new.message);
+    END
+    ''')
+    # Rows that existed before the triggers are indexed in chunks. Progress is
+    # committed with each chunk so an interrupted backfill picks up where it stopped.
+    connection.execute("CREATE TABLE IF NOT EXISTS schema_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    connection.execute(
+        "INSERT OR IGNORE INTO schema_meta (key, value) SELECT 'fts_backfill_upto', COALESCE(MAX(id), 0) FROM memories"
+    )
+    connection.execute("INSERT OR IGNORE INTO schema_meta (key, value) VALUES ('fts_backfill_done', 0)")
+    connection.commit()
+    upto = connection.execute("SELECT value FROM schema_meta WHERE key='fts_backfill_upto'").fetchone()[0]
+    done = connection.execute("SELECT value FROM schema_meta WHERE key='fts_backfill_done'").fetchone()[0]
+    while done < upto:
+        chunk_end = min(done + MIGRATION_CHUNK_SIZE, upto)
+        with connection:
+            connection.execute(
+                "INSERT INTO memories_fts (rowid, message) SELECT id, message FROM memories WHERE id > ? AND id <= ?",
+                (done, chunk_end)
+            )
+            connection.execute("UPDATE schema_meta SET value=? WHERE key='fts_backfill_done'", (chunk_end,))
+        done = chunk_end
+        print(f"[DEBUG] Indexed memories for full-text search up to id {done} of {upto}.")
+
+def _migrate_to_v5(connection):
+    # last_id is the newest memory already folded into the summary.
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS summaries (
+        server_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        last_id INTEGER NOT NULL,
+        updated_ts INTEGER NOT NULL,
+        PRIMARY KEY (server_id, channel_id)
+    )
+    ''')
+
+def _migrate_to_v6(connection):
+    connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts_vocab USING fts5vocab(memories_fts, 'row')")
+
+_MIGRATIONS = [
+    (1, _migrate_to_v1),
+    (2, _migrate_to_v2),
+    (3, _migrate_to_v3),
+    (4, _migrate_to_v4),
+    (5, _migrate_to_v5),
+    (6, _migrate_to_v6),
+]
+
+def migrate(connection):
+    """Brings the database up to SCHEMA_VERSION, one versioned step at a time."""
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in _MIGRATIONS:
+        if version >= target:
+            continue
+        print(f"[DEBUG] Migrating memories.db from schema v{version} to v{target}.")
+        step(connection)
+        connection.execute(f"PRAGMA user_version = {target}")
+        connection.commit()
+        version = target
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if VACUUM_CONVERT_ON_START:
+            convert_to_incremental_vacuum(connection)
+        else:
+            print("[DEBUG] memories.db is not in incremental auto_vacuum mode, so retention cannot return "
+                  "freed space to the OS. Start once with CHODE_VACUUM_CONVERT=1 to convert it (full VACUUM).")
+
+conn = connect()
 c = conn.cursor()
-c.execute('''
-CREATE TABLE IF NOT EXISTS memories (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    server_id TEXT,
-    channel_id TEXT,
-    user_id TEXT,
-    message TEXT,
-    timestamp TEXT
-)
-''')
-conn.commit()
+migrate(conn)
+
+_local = threading.local()
+
+def read_connection():
+    """Returns a connection owned by the calling thread, for reads done off the event loop."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = connect()
+        _local.connection = connection
+    return connection
+
+_STOP = object()
+
+class MemoryWriter:
+    """
+    Write-behind writer for the memories table.
+    Rows are queued from the event loop without touching SQLite and committed
+    in batches by a background thread that owns its own connection.
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=WRITE_BATCH_SIZE,
+                 flush_interval=WRITE_FLUSH_INTERVAL, maxsize=WRITE_QUEUE_MAXSIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Rows submitted but not yet committed (or dropped), in queue order.
+        self._pending = deque()
+        self._pending_lock = threading.Lock()
+        self.committed = 0
+        self.dropped = 0
+        self.commits = 0
+        self.retries = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self._commit_total_ms = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, row):
+        """Queues a row for insertion. Never blocks; drops the row if the queue is full."""
+        try:
+            with self._pending_lock:
+                self.queue.put_nowait(row)
+                self._pending.append(row)
+        except queue.Full:
+            self.dropped += 1
+            print(f"[DEBUG] Memory write queue full, dropped message ({self.dropped} dropped so far).")
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued before this call has been committed."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def pending_rows(self, server_key, channel_key):
+        """Returns the channel's rows that are queued or being committed, oldest first."""
+        with self._pending_lock:
+            return [row for row in self._pending if row[0] == server_key and row[1] == channel_key]
+
+    def close(self, timeout=10):
+        """Commits whatever is still queued and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "committed": self.committed,
+            "dropped": self.dropped,
+            "commits": self.commits,
+            "retries": self.retries,
+            "last_commit_ms": round(self.last_commit_ms, 3),
+            "avg_commit_ms": round(self._commit_total_ms / self.commits, 3) if self.commits else 0.0,
+            "max_commit_ms": round(self.max_commit_ms, 3),
+        }
+
+    def _run(self):
+        connection = connect(self.path)
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drain anything that raced in behind the stop marker.
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._commit(connection, batch)
+                with self._pending_lock:
+                    for _ in batch:
+                        self._pending.popleft()
+            for waiter in waiters:
+                waiter.set()
+        connection.close()
+
+    def _commit(self, connection, batch):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO memories (server_id, channel_id, user_id, message, ts) VALUES (?, ?, ?, ?, ?)",
+                        batch
+                    )
+                break
+            except Exception as e:
+                if attempt >= WRITE_COMMIT_RETRIES:
+                    self.dropped += len(batch)
+                    print(f"[DEBUG] Error committing {len(batch)} memories, dropped them after "
+                          f"{attempt} retries ({self.dropped} dropped so far): {e}")
+                    return
+                attempt += 1
+                self.retries += 1
+                print(f"[DEBUG] Error committing {len(batch)} memories, retry {attempt}: {e}")
+                time.sleep(WRITE_RETRY_BACKOFF * 2 ** (attempt - 1))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.committed += len(batch)
+        self.commits += 1
+        self.last_commit_ms = elapsed_ms
+        self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+        self._commit_total_ms += elapsed_ms
+
+_writer = MemoryWriter()
+_writer.start()
+atexit.register(_writer.close)
+
+_cache = ConversationCache()
+
+def format_memory_line(user_id, message, ts):
+    return f"User {user_id} at {format_timestamp(ts)}: {message}\n"
+
+def _cache_entry(user_id, message, ts):
+    return (user_id, message, ts, format_memory_line(user_id, message, ts))
 
 def store_memory(server_id, channel_id, user_id, message):
-    timestamp = datetime.datetime.utcnow().isoformat()
-    c.execute(
-        "INSERT INTO memories (server_id, channel_id, user_id, message, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (str(server_id), str(channel_id), str(user_id), message, timestamp)
+    ts = int(time.time() * 1000)
+    server_key = encode_server_id(server_id)
+    channel_key = int(channel_id)
+    _writer.submit((server_key, channel_key, int(user_id), message, ts))
+    _cache.append((server_key, channel_key), _cache_entry(int(user_id), message, ts))
+
+def flush_memories(timeout=None):
+    """Waits for all queued memories to reach the database."""
+    return _writer.flush(timeout)
+
+def writer_stats():
+    """Returns queue depth, drop count and commit latency figures for the memory writer."""
+    return _writer.stats()
+
+def forget_cached_conversation(server_key, channel_key):
+    """Drops a channel's cached history, e.g. after rows were removed from the database."""
+    _cache.invalidate((server_key, channel_key))
+
+def cache_stats():
+    """Returns size, hit rate and eviction figures for the conversation cache."""
+    return _cache.stats()
+
+def _warm_channel(key, limit, appended):
+    # Cold channel: warm the buffer with one read, plus the rows the writer has not
+    # committed yet and those stored since begin_warm(). The pending rows are taken
+    # before the read so a row committed in between is found by the read rather
+    # than missed by both. Blocking; runs on the calling thread's own connection.
+    try:
+        pending = _writer.pending_rows(key[0], key[1])
+        fetch = max(limit, CACHE_LINES_PER_CHANNEL)
+        rows = read_connection().execute(
+            "SELECT user_id, message, ts FROM memories WHERE server_id=? AND channel_id=? ORDER BY ts DESC LIMIT ?",
+            (key[0], key[1], fetch)
+        ).fetchall()
+    except BaseException:
+        _cache.end_warm(key, appended)
+        raise
+    entries = merge_entries(
+        [_cache_entry(row[0], row[1], row[2]) for row in reversed(rows)],
+        [_cache_entry(row[2], row[3], row[4]) for row in pending],
     )
-    conn.commit()
+    return _cache.warm(key, entries, complete=len(rows) < fetch, appended=appended)[-limit:]
 
 def get_recent_conversation(server_id, channel_id, limit=10):
-    c.execute(
-        "SELECT user_id, message, timestamp FROM memories WHERE server_id=? AND channel_id=? ORDER BY timestamp DESC LIMIT ?",
-        (str(server_id), str(channel_id), limit)
-    )
-    rows = c.fetchall()
-    conversation = ""
-    for row in reversed(rows):
-        conversation += f"User {row[0]} at {format_timestamp(row[2])}: {row[1]}\n"
-    return conversation
+    """Blocking on a cache miss; the bot's event loop uses get_recent_messages_async."""
+    key = (encode_server_id(server_id), int(channel_id))
+    conversation = _cache.get(key, limit)
+    if conversation is not None:
+        return conversation
+    return "".join(entry[3] for entry in _warm_channel(key, limit, _cache.begin_warm(key)))
+
+def get_recent_messages(server_id, channel_id, limit=10):
+    """Returns the channel's last `limit` messages as (user_id, message, ts) rows, oldest first. Blocking on a cache miss."""
+    key = (encode_server_id(server_id), int(channel_id))
+    rows = _cache.get_rows(key, limit)
+    if rows is not None:
+        return rows
+    return [entry[:3] for entry in _warm_channel(key, limit, _cache.begin_warm(key))]
+
+async def get_recent_messages_async(server_id, channel_id, limit=10):
+    """get_recent_messages for the event loop: cache hits are served inline, cold channels read in a worker thread."""
+    key = (encode_server_id(server_id), int(channel_id))
+    rows = _cache.get_rows(key, limit)
+    if rows is not None:
+        return rows
+    appended = _cache.begin_warm(key)
+    entries = await asyncio.to_thread(_warm_channel, key, limit, appended)
+    return [entry[:3] for entry in entries]
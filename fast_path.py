@@ -0,0 +1,62 @@
+import random
+from chode import config
+
+# Questions whose answer is already known are answered from templates instead
+# of the LLM. A guild can set "fast_path_llm": true in its config to have them
+# phrased by the model again, and "templates": {"<intent>": ["...", ...]} to
+# replace the default phrasings below.
+FAST_PATH_USE_LLM = False
+
+DEFAULT_TEMPLATES = {
+    "server_info": [
+        "This is {name} (ID {id}), home to {member_count} members.",
+        "You're in {name}! Server ID {id}, with {member_count} members.",
+        "{name}, ID {id}. We've got {member_count} members here.",
+    ],
+    "member_playing": [
+        "{info}",
+    ],
+}
+
+# Intent name and the phrases that must all appear in the lowercased message content.
+INTENTS = [
+    ("member_playing", ("what is", "playing")),
+    ("server_info", ("what server",)),
+]
+
+_stats = {"answered": {}, "sent_to_llm": {}}
+
+def match_intent(content):
+    """Returns the name of the first intent the message matches, or None."""
+    content = content.lower()
+    for name, phrases in INTENTS:
+        if all(phrase in content for phrase in phrases):
+            return name
+    return None
+
+def use_llm(guild_id):
+    """True if this guild wants template answers phrased by the LLM instead."""
+    if guild_id is None:
+        return FAST_PATH_USE_LLM
+    return bool(config.load_server_config(guild_id).get("fast_path_llm", FAST_PATH_USE_LLM))
+
+def render(intent, guild_id=None, **fields):
+    """Fills one of the guild's phrasings for the intent, or a default one."""
+    variants = None
+    if guild_id is not None:
+        variants = (config.load_server_config(guild_id).get("templates") or {}).get(intent)
+    try:
+        text = random.choice(variants or DEFAULT_TEMPLATES[intent]).format(**fields)
+    except Exception as e:
+        print(f"[DEBUG] Bad {intent} template for guild {guild_id}: {e}")
+        text = random.choice(DEFAULT_TEMPLATES[intent]).format(**fields)
+    record(intent, llm=False)
+    return text
+
+def record(intent, llm):
+    counts = _stats["sent_to_llm" if llm else "answered"]
+    counts[intent] = counts.get(intent, 0) + 1
+
+def fast_path_stats():
+    """Returns how many requests per intent were answered from templates or sent to the LLM."""
+    return {key: dict(value) for key, value in _stats.items()}
@@ -0,0 +1,254 @@
+import math
+import asyncio
+import itertools
+from collections import deque
+from chode import comfyui
+from chode.loop_local import PerLoop
+
+# Image generations wait in an in-bot queue instead of all going to ComfyUI at
+# once. Waiting jobs are started round-robin across users, so one user's pile
+# of prompts cannot starve everyone else, and caps limit how many jobs one
+# user or guild has running. Users waiting get a status message with their
+# position and an ETA from measured job durations, updated while they wait.
+IMAGE_MAX_RUNNING = 1            # Jobs handed to ComfyUI at once; it runs them one after another anyway.
+IMAGE_MAX_RUNNING_PER_USER = 1
+IMAGE_MAX_RUNNING_PER_GUILD = 2
+IMAGE_MAX_QUEUED_PER_USER = 3    # Further requests are refused until one finishes.
+IMAGE_DEFAULT_DURATION = 30      # Assumed seconds per job until some have been measured.
+IMAGE_DURATION_SAMPLES = 20      # Recent job durations the ETA is averaged over.
+IMAGE_UPDATE_INTERVAL = 10       # Seconds between status message edits.
+
+class ImageQueueFull(Exception):
+    """Raised when a user already has IMAGE_MAX_QUEUED_PER_USER jobs waiting or running."""
+
+class JobCancelled(Exception):
+    """Raised to a waiting job's caller when its user cancels it."""
+
+class ImageJob:
+    def __init__(self, job_id, user_id, guild_id, channel, mention, future, enqueued_at):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.channel = channel
+        self.mention = mention
+        self.future = future
+        self.enqueued_at = enqueued_at
+        self.status_message = None
+        self.status_text = None
+
+class ImageQueue:
+    """
+    Starts at most max_running image jobs at once, taking the next job from
+    the waiting user who was served least recently. A user's next job is
+    skipped over while that user or their guild is at its running cap.
+    """
+
+    def __init__(self, max_running=IMAGE_MAX_RUNNING):
+        self.max_running = max_running
+        self._waiting = {}             # Key: user_id, Value: deque of ImageJob
+        self._last_started = {}        # Key: user_id with jobs, Value: sequence number of their last start
+        self._starts = itertools.count()
+        self._running = {}             # Key: job_id, Value: ImageJob
+        self._running_users = {}
+        self._running_guilds = {}
+        self._ids = itertools.count(1)
+        self._durations = deque(maxlen=IMAGE_DURATION_SAMPLES)
+        self._updater = None
+        self.counts = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "refused": 0}
+        self._wait_total = 0.0
+
+    async def run(self, user_id, guild_id, channel, job, mention=None):
+        """
+        Queues job (a coroutine function) for the user, waits for its turn and
+        runs it. Status messages go to channel, addressed to mention. Raises
+        ImageQueueFull if the user has too many jobs, or JobCancelled if the
+        user cancels it while it waits.
+        """
+        loop = asyncio.get_running_loop()
+        if self._user_jobs(user_id) >= IMAGE_MAX_QUEUED_PER_USER:
+            self.counts["refused"] += 1
+            raise ImageQueueFull(f"You already have {IMAGE_MAX_QUEUED_PER_USER} images queued; "
+                                 f"wait for one to finish or cancel with !!cancelimg.")
+        entry = ImageJob(next(self._ids), user_id, guild_id, channel, mention, loop.create_future(), loop.time())
+        self._waiting.setdefault(user_id, deque()).append(entry)
+        self.counts["submitted"] += 1
+        self._dispatch()
+        if not entry.future.done():
+            await self._show_status(entry)
+            if self._updater is None or self._updater.done():
+                self._updater = loop.create_task(self._update_loop())
+        try:
+            await entry.future
+        except JobCancelled:
+            await self._set_status(entry, f"Image job #{entry.job_id} cancelled.")
+            raise
+        except asyncio.CancelledError:
+            if entry.job_id in self._running:
+                self._finish(entry, None)
+            else:
+                self._remove_waiting(entry)
+            raise
+        started_at = loop.time()
+        self._wait_total += started_at - entry.enqueued_at
+        if entry.status_message is not None:
+            await self._set_status(entry, f"Image job #{entry.job_id} is generating now.")
+        duration = None
+        try:
+            result = await job()
+            duration = loop.time() - started_at
+            return result
+        finally:
+            self._finish(entry, duration)
+
+    def cancel(self, user_id, job_id=None):
+        """Cancels the user's waiting jobs (only job_id if given); returns how many were cancelled."""
+        jobs = self._waiting.get(user_id, ())
+        cancelled = [job for job in jobs if job_id is None or job.job_id == job_id]
+        for job in cancelled:
+            self._remove_waiting(job)
+            job.future.set_exception(JobCancelled(f"Image job #{job.job_id} was cancelled."))
+        self.counts["cancelled"] += len(cancelled)
+        return len(cancelled)
+
+    def _user_jobs(self, user_id):
+        running = self._running_users.get(user_id, 0)
+        return running + len(self._waiting.get(user_id, ()))
+
+    def _remove_waiting(self, job):
+        jobs = self._waiting.get(job.user_id)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._waiting[job.user_id]
+                if job.user_id not in self._running_users:
+                    self._last_started.pop(job.user_id, None)
+
+    def _turn_order(self):
+        # Users never served (or idle since) come first, then by their oldest waiting job.
+        return sorted(self._waiting, key=lambda user_id: (self._last_started.get(user_id, -1),
+                                                          self._waiting[user_id][0].job_id))
+
+    def _next_job(self):
+        for user_id in self._turn_order():
+            jobs = self._waiting[user_id]
+            job = jobs[0]
+            if self._running_users.get(user_id, 0) >= IMAGE_MAX_RUNNING_PER_USER:
+                continue
+            if job.guild_id is not None and self._running_guilds.get(job.guild_id, 0) >= IMAGE_MAX_RUNNING_PER_GUILD:
+                continue
+            jobs.popleft()
+            if not jobs:
+                del self._waiting[user_id]
+            self._last_started[user_id] = next(self._starts)
+            return job
+        return None
+
+    def _dispatch(self):
+        while len(self._running) < self.max_running:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running[job.job_id] = job
+            self._running_users[job.user_id] = self._running_users.get(job.user_id, 0) + 1
+            if job.guild_id is not None:
+                self._running_guilds[job.guild_id] = self._running_guilds.get(job.guild_id, 0) + 1
+            job.future.set_result(None)
+
+    def _finish(self, job, duration):
+        if self._running.pop(job.job_id, None) is None:
+            return
+        for counts, key in ((self._running_users, job.user_id), (self._running_guilds, job.guild_id)):
+            if key in counts:
+                counts[key] -= 1
+                if counts[key] <= 0:
+                    del counts[key]
+        if job.user_id not in self._running_users and job.user_id not in self._waiting:
+            self._last_started.pop(job.user_id, None)
+        if duration is not None:
+            self._durations.append(duration)
+            self.counts["completed"] += 1
+        else:
+            self.counts["failed"] += 1
+        self._dispatch()
+
+    def waiting_order(self):
+        """Waiting jobs in the order round-robin would start them, ignoring the running caps."""
+        queues = [list(self._waiting[user_id]) for user_id in self._turn_order()]
+        order = []
+        for turn in range(max((len(jobs) for jobs in queues), default=0)):
+            order.extend(jobs[turn] for jobs in queues if turn < len(jobs))
+        return order
+
+    def average_duration(self):
+        if not self._durations:
+            return IMAGE_DEFAULT_DURATION
+        return sum(self._durations) / len(self._durations)
+
+    def eta(self, position):
+        """Seconds until the job at this 1-based waiting position finishes."""
+        # ComfyUI runs one job at a time and only one is handed to it, so a
+        # measured duration is one job's execution and jobs ahead add up.
+        jobs = len(self._running) + position
+        return math.ceil(jobs * self.average_duration())
+
+    def _status_text(self, job, position):
+        prefix = f"{job.mention} " if job.mention else ""
+        return (f"{prefix}Image job #{job.job_id}: you are #{position} in the queue, "
+                f"ETA ~{self.eta(position)}s. Cancel with !!cancelimg {job.job_id}.")
+
+    async def _show_status(self, job):
+        order = self.waiting_order()
+        if job in order:
+            await self._set_status(job, self._status_text(job, order.index(job) + 1))
+
+    async def _set_status(self, job, text):
+        if text == job.status_text:
+            return
+        job.status_text = text
+        try:
+            if job.status_message is None:
+                job.status_message = await job.channel.send(text)
+            else:
+                await job.status_message.edit(content=text)
+        except Exception as e:
+            print(f"[DEBUG] Could not update image queue status for job #{job.job_id}: {e}")
+
+    async def _update_loop(self):
+        while self._waiting:
+            await asyncio.sleep(IMAGE_UPDATE_INTERVAL)
+            for position, job in enumerate(self.waiting_order(), start=1):
+                await self._set_status(job, self._status_text(job, position))
+
+    def stats(self):
+        started = self.counts["completed"] + self.counts["failed"] + len(self._running)
+        return {
+            "running": len(self._running),
+            "waiting": sum(len(jobs) for jobs in self._waiting.values()),
+            "waiting_users": len(self._waiting),
+            "avg_duration_s": round(self.average_duration(), 3),
+            "avg_wait_s": round(self._wait_total / started, 3) if started else 0.0,
+            **self.counts,
+        }
+
+_queues = PerLoop(ImageQueue)
+
+def get_queue():
+    return _queues.get()
+
+async def generate(ctx, prompt_text):
+    """Queues an image generation for ctx's author and posts the images when its turn comes."""
+    guild_id = ctx.guild.id if ctx.guild else None
+    return await get_queue().run(
+        ctx.author.id, guild_id, ctx.channel,
+        lambda: comfyui.generate_and_send_images(prompt_text, ctx),
+        mention=ctx.author.mention
+    )
+
+def cancel(user_id, job_id=None):
+    """Cancels the user's waiting image jobs on the running loop's queue."""
+    return get_queue().cancel(user_id, job_id)
+
+def image_queue_stats():
+    """Returns running and waiting job counts, average job duration and wait, and outcome counts."""
+    queue = _queues.existing()
+    return queue.stats() if queue is not None else {}
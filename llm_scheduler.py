@@ -0,0 +1,130 @@
+import heapq
+import asyncio
+import itertools
+import contextlib
+from chode.loop_local import PerLoop
+
+# Priority classes; lower runs first.
+PRIORITY_INTERACTIVE = 0   # Mention and DM replies, chodehelp.
+PRIORITY_REWORD = 1        # Prompt rewording for image generation.
+PRIORITY_BACKGROUND = 2    # Summaries and memory embeddings.
+PRIORITY_REACTION = 3      # Decorative emoji reactions.
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_REWORD: "reword",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_REACTION: "reaction",
+}
+
+LLM_MAX_IN_FLIGHT = 2   # Per LMStudio backend.
+# Jobs waiting beyond these depths are refused straight away instead of queueing.
+MAX_QUEUED = {
+    PRIORITY_BACKGROUND: 50,
+    PRIORITY_REACTION: 20,
+}
+
+class JobDropped(Exception):
+    """Raised when a low-priority LLM job is refused or expires before it gets a slot."""
+
+class LLMScheduler:
+    """
+    Hands out LMStudio request slots by priority. At most max_in_flight jobs run
+    at once; waiting jobs are served lowest priority value first, FIFO within a
+    class. Jobs with max_wait are dropped if they have not started in time.
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self.started = {priority: 0 for priority in PRIORITY_NAMES}
+        self.dropped = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=PRIORITY_INTERACTIVE, max_wait=None):
+        """Waits for a slot, runs the body, then hands the slot to the next job."""
+        await self._acquire(priority, max_wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority, max_wait):
+        loop = asyncio.get_running_loop()
+        if self.in_flight < self.max_in_flight and not self._heap:
+            self.in_flight += 1
+            self.started[priority] += 1
+            return
+        limit = MAX_QUEUED.get(priority)
+        if limit is not None and self._queued[priority] >= limit:
+            self.dropped[priority] += 1
+            raise JobDropped(f"{PRIORITY_NAMES[priority]} queue is full")
+        future = loop.create_future()
+        enqueued_at = loop.time()
+        heapq.heappush(self._heap, (priority, next(self._seq), future, enqueued_at))
+        self._queued[priority] += 1
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self._queued[priority] -= 1
+            self.dropped[priority] += 1
+            raise JobDropped(f"{PRIORITY_NAMES[priority]} job waited more than {max_wait}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled; give it back.
+                self._release()
+            else:
+                self._queued[priority] -= 1
+            raise
+        self._wait_total[priority] += loop.time() - enqueued_at
+
+    def resize(self, max_in_flight):
+        """Changes how many jobs may run at once, starting waiting jobs if there is new room."""
+        self.max_in_flight = max_in_flight
+        self._dispatch()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._heap and self.in_flight < self.max_in_flight:
+            priority, _, future, _ = heapq.heappop(self._heap)
+            if future.done():
+                # Expired or cancelled while waiting; already accounted for.
+                continue
+            self._queued[priority] -= 1
+            self.in_flight += 1
+            self.started[priority] += 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": {PRIORITY_NAMES[p]: n for p, n in self._queued.items()},
+            "started": {PRIORITY_NAMES[p]: n for p, n in self.started.items()},
+            "dropped": {PRIORITY_NAMES[p]: n for p, n in self.dropped.items()},
+            "avg_wait_ms": {
+                PRIORITY_NAMES[p]: round(self._wait_total[p] / self.started[p] * 1000, 3) if self.started[p] else 0.0
+                for p in PRIORITY_NAMES
+            },
+        }
+
+_schedulers = PerLoop(LLMScheduler)
+
+def get_scheduler():
+    return _schedulers.get()
+
+def slot(priority=PRIORITY_INTERACTIVE, max_wait=None):
+    """Async context manager granting an LMStudio slot on the running loop's scheduler."""
+    return get_scheduler().slot(priority, max_wait)
+
+def scheduler_stats():
+    """Returns queue depths, started/dropped counts and average waits per priority class."""
+    scheduler = _schedulers.existing()
+    return scheduler.stats() if scheduler is not None else {}
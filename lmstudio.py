@@ -1,35 +1,517 @@
-import requests
-from chode import config
+import json
+import time
+import random
+import asyncio
+import aiohttp
+from chode import config, llm_scheduler, response_cache
+from chode.llm_scheduler import PRIORITY_INTERACTIVE
 
 LMSTUDIO_URL = "http://127.0.0.1:1234"
+# OpenAI-compatible endpoints requests are spread over; add URLs to scale out.
+LMSTUDIO_URLS = [LMSTUDIO_URL]
+CHAT_MODEL = "default"
+EMBEDDING_MODEL = "default"
+LMSTUDIO_ERROR_PREFIX = "Error communicating with LMStudio"
+# Sent instead of calling LMStudio while the circuit breaker is open.
+LMSTUDIO_UNAVAILABLE_REPLY = "My brain is offline right now, try me again in a minute."
 
-def chat_completion(prompt: str, system_message: str = "You are chode the chatbot.") -> str:
-    url = f"{LMSTUDIO_URL}/v1/chat/completions"
-    payload = {
-        "model": "default",
-        "messages": [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt}
-        ]
-    }
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"Error communicating with LMStudio: {e}"
+# Async client tuning.
+LMSTUDIO_TIMEOUT = 120          # Default per-request deadline in seconds.
+LMSTUDIO_MAX_CONCURRENCY = 4    # Requests allowed in flight at once, per backend.
+LMSTUDIO_POOL_SIZE = 8          # Keep-alive connections kept open to each backend.
+LMSTUDIO_KEEPALIVE = 60         # Seconds an idle pooled connection is kept.
 
-def call_lmstudio(prompt: str) -> str:
-    return chat_completion(prompt)
+# Backend health.
+LMSTUDIO_HEALTH_INTERVAL = 15   # Seconds between /v1/models probes.
+LMSTUDIO_HEALTH_TIMEOUT = 5     # Deadline for one probe.
+LMSTUDIO_EJECT_SECONDS = 30     # How long a failing backend is taken out of rotation.
 
-def call_lmstudio_with_personality(prompt: str, guild_id: str) -> str:
+# Failure handling.
+LMSTUDIO_RETRIES = 2            # Extra attempts after a connection error.
+LMSTUDIO_RETRY_BACKOFF = 0.25   # Base of the jittered exponential backoff, in seconds.
+LMSTUDIO_BREAKER_FAILURES = 5   # Consecutive failed requests that open the circuit breaker.
+LMSTUDIO_BREAKER_COOLDOWN = 30  # Seconds the breaker stays open before letting a trial request through.
+
+class CircuitOpen(Exception):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Fails LMStudio calls fast after repeated failures. Closed: requests flow.
+    Open: requests are refused for the cooldown. Half-open: one trial request
+    is let through; its success closes the breaker, its failure reopens it.
+    """
+
+    def __init__(self, threshold=LMSTUDIO_BREAKER_FAILURES, cooldown=LMSTUDIO_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.trial_started = 0.0
+        if self.state == "half_open":
+            # A trial that never reported back (e.g. an abandoned stream) is replaced after a cooldown.
+            if now - self.trial_started >= self.cooldown:
+                self.trial_started = now
+                return True
+        elif self.state == "closed":
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, error=None):
+        """Records a finished request; error is the exception it raised, if any."""
+        if error is None or not _counts_against_breaker(error):
+            if self.state != "closed":
+                print("[DEBUG] LMStudio circuit breaker closed.")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.threshold):
+            print(f"[DEBUG] LMStudio circuit breaker opened after {self.consecutive_failures} failures: {error}")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+class Backend:
+    """One LMStudio endpoint and its routing state."""
+
+    def __init__(self, url, max_concurrency):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.models = []
+        self.last_error = None
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def eject(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+        if self.ejected_until <= time.monotonic():
+            print(f"[DEBUG] Taking LMStudio backend {self.url} out of rotation: {error}")
+        self.ejected_until = time.monotonic() + LMSTUDIO_EJECT_SECONDS
+
+    def stats(self):
+        return {
+            "outstanding": self.outstanding,
+            "healthy": self.available(time.monotonic()),
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": self.models,
+            "last_error": self.last_error,
+        }
+
+class BackendPool:
+    """
+    Routes each request to the healthy backend with the fewest requests
+    outstanding, picking at random among ties. If every backend is out of
+    rotation, the one due back soonest is used rather than failing outright.
+    """
+
+    def __init__(self, urls, max_concurrency=LMSTUDIO_MAX_CONCURRENCY):
+        self.backends = [Backend(url, max_concurrency) for url in urls]
+
+    def pick(self):
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends if backend.available(now)]
+        if not candidates:
+            return min(self.backends, key=lambda backend: backend.ejected_until)
+        fewest = min(backend.outstanding for backend in candidates)
+        return random.choice([backend for backend in candidates if backend.outstanding == fewest])
+
+    def stats(self):
+        return {backend.url: backend.stats() for backend in self.backends}
+
+def _is_backend_failure(error):
+    # Connection problems and server errors count against a backend; a slow
+    # generation hitting its deadline or a bad request does not.
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, aiohttp.ClientConnectionError)
+
+def _is_retryable(error):
+    # Only connection errors are retried; a timed-out generation would just time out again.
+    return isinstance(error, aiohttp.ClientConnectionError) and not isinstance(error, asyncio.TimeoutError)
+
+def _counts_against_breaker(error):
+    return _is_backend_failure(error) or isinstance(error, asyncio.TimeoutError)
+
+def _backoff(attempt):
+    return random.uniform(0, LMSTUDIO_RETRY_BACKOFF * 2 ** attempt)
+
+def _messages(prompt, system_message):
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt}
+    ]
+
+def is_error_reply(text):
+    """True for the error and breaker replies the chat calls return instead of raising."""
+    return text.startswith(LMSTUDIO_ERROR_PREFIX) or text == LMSTUDIO_UNAVAILABLE_REPLY
+
+class AsyncLMStudioClient:
+    """
+    asyncio client for LMStudio's OpenAI-compatible API, spread over one or
+    more backends. Reuses keep-alive connections from one aiohttp session and
+    caps the requests in flight per backend. The session is bound to the loop
+    that first uses it; health probes run on that loop.
+    """
+
+    def __init__(self, urls=None, max_concurrency=LMSTUDIO_MAX_CONCURRENCY,
+                 pool_size=LMSTUDIO_POOL_SIZE, timeout=LMSTUDIO_TIMEOUT):
+        self.pool = BackendPool(urls or LMSTUDIO_URLS, max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.loop = None
+        self._session = None
+        self._health_task = None
+
+    def _ensure_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self.loop is not loop:
+            self.loop = loop
+            connector = aiohttp.TCPConnector(limit=self.pool_size * len(self.pool.backends),
+                                             limit_per_host=self.pool_size,
+                                             keepalive_timeout=LMSTUDIO_KEEPALIVE)
+            self._session = aiohttp.ClientSession(connector=connector)
+            for backend in self.pool.backends:
+                backend.semaphore = asyncio.Semaphore(backend.max_concurrency)
+            self._health_task = None
+        return self._session
+
+    async def _request(self, backend, session, method, path, payload, timeout):
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with backend.semaphore:
+            async with session.request(method, f"{backend.url}{path}", json=payload,
+                                       timeout=client_timeout) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def request_json(self, method, path, payload=None, timeout=None):
+        """
+        Sends one request to the least busy backend and returns the decoded JSON
+        body, retrying connection errors on another pick. Raises CircuitOpen
+        while the breaker is open, and HTTP or connection errors otherwise.
+        """
+        session = self._ensure_session()
+        if not self.breaker.allow():
+            raise CircuitOpen("LMStudio circuit breaker is open")
+        attempt = 0
+        while True:
+            backend = self.pool.pick()
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                result = await self._request(backend, session, method, path, payload, timeout)
+            except Exception as e:
+                if _is_backend_failure(e):
+                    backend.eject(e)
+                if _is_retryable(e) and attempt < LMSTUDIO_RETRIES:
+                    attempt += 1
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                self.breaker.record(e)
+                raise
+            finally:
+                backend.outstanding -= 1
+            self.breaker.record()
+            return result
+
+    async def list_models(self, backend=None, timeout=None):
+        """Returns the /v1/models listing from the given backend, or from the least busy one."""
+        if backend is None:
+            return await self.request_json("GET", "/v1/models", timeout=timeout)
+        return await self._request(backend, self._ensure_session(), "GET", "/v1/models", None, timeout)
+
+    async def check_health(self):
+        """Probes every backend's /v1/models once, ejecting those that fail and restoring those that answer."""
+        async def probe(backend):
+            try:
+                data = await self.list_models(backend, timeout=LMSTUDIO_HEALTH_TIMEOUT)
+            except Exception as e:
+                backend.eject(e)
+                return
+            if not backend.available(time.monotonic()):
+                print(f"[DEBUG] LMStudio backend {backend.url} is back in rotation.")
+            backend.ejected_until = 0.0
+            backend.models = [model.get("id") for model in data.get("data", [])]
+        await asyncio.gather(*(probe(backend) for backend in self.pool.backends))
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"[DEBUG] Error probing LMStudio backends: {e}")
+            await asyncio.sleep(LMSTUDIO_HEALTH_INTERVAL)
+
+    def start_health_checks(self):
+        """Starts the periodic backend probes on the running loop, once per session."""
+        self._ensure_session()
+        if self._health_task is None or self._health_task.done():
+            self._health_task = self.loop.create_task(self._health_loop())
+        return self._health_task
+
+    async def chat(self, messages, timeout=None, temperature=None):
+        """Sends a list of chat messages and returns the reply text, or an error text on failure."""
+        payload = {
+            "model": CHAT_MODEL,
+            "messages": messages
+        }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        try:
+            data = await self.request_json("POST", "/v1/chat/completions", payload, timeout)
+            return data["choices"][0]["message"]["content"]
+        except CircuitOpen:
+            return LMSTUDIO_UNAVAILABLE_REPLY
+        except Exception as e:
+            return f"{LMSTUDIO_ERROR_PREFIX}: {e or type(e).__name__}"
+
+    async def chat_completion(self, prompt, system_message="You are chode the chatbot.", timeout=None,
+                              temperature=None):
+        return await self.chat(_messages(prompt, system_message), timeout=timeout, temperature=temperature)
+
+    async def stream_chat(self, messages, timeout=None):
+        """
+        Yields content deltas as LMStudio streams them (server-sent events with
+        "stream": true). On failure before any content, yields the error text instead.
+        """
+        payload = {
+            "model": CHAT_MODEL,
+            "stream": True,
+            "messages": messages
+        }
+        session = self._ensure_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        if not self.breaker.allow():
+            yield LMSTUDIO_UNAVAILABLE_REPLY
+            return
+        attempt = 0
+        produced = False
+        while True:
+            backend = self.pool.pick()
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                async with backend.semaphore:
+                    async with session.post(f"{backend.url}/v1/chat/completions", json=payload,
+                                            timeout=client_timeout) as response:
+                        response.raise_for_status()
+                        async for raw_line in response.content:
+                            line = raw_line.decode("utf-8", errors="replace").strip()
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            try:
+                                event = json.loads(data)
+                            except ValueError:
+                                continue
+                            choices = event.get("choices") or [{}]
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                produced = True
+                                yield delta
+                self.breaker.record()
+                return
+            except Exception as e:
+                if _is_backend_failure(e):
+                    backend.eject(e)
+                if not produced and _is_retryable(e) and attempt < LMSTUDIO_RETRIES:
+                    attempt += 1
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                self.breaker.record(e)
+                if not produced:
+                    yield f"{LMSTUDIO_ERROR_PREFIX}: {e or type(e).__name__}"
+                else:
+                    print(f"[DEBUG] LMStudio stream interrupted: {e}")
+                return
+            finally:
+                backend.outstanding -= 1
+
+    def stream_chat_completion(self, prompt, system_message="You are chode the chatbot.", timeout=None):
+        return self.stream_chat(_messages(prompt, system_message), timeout=timeout)
+
+    async def get_embeddings(self, text, timeout=None):
+        payload = {
+            "model": EMBEDDING_MODEL,
+            "input": text
+        }
+        try:
+            data = await self.request_json("POST", "/v1/embeddings", payload, timeout)
+            return data.get("data")
+        except Exception as e:
+            return f"{LMSTUDIO_ERROR_PREFIX}: {e or type(e).__name__}"
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+_client = AsyncLMStudioClient()
+
+def attach_to_running_loop():
+    """
+    Binds the shared client to the running loop (the bot's), so blocking calls
+    from worker threads are routed through it, its pool and its scheduler,
+    sizes the scheduler for the configured backends and starts health probes.
+    """
+    _client._ensure_session()
+    llm_scheduler.get_scheduler().resize(llm_scheduler.LLM_MAX_IN_FLIGHT * len(_client.pool.backends))
+    _client.start_health_checks()
+
+def _run_sync(async_fn, *args, **kwargs):
+    """
+    Runs one of the module's coroutines from synchronous code. From a worker
+    thread while the bot is running, the call is handed to the bot's loop so it
+    goes through the scheduler and shares the connection pool; with no loop
+    running, a short-lived client is used.
+    """
+    loop = _client.loop
+    if loop is not None and loop.is_running():
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("Blocking LMStudio call on the event loop; await the *_async variant instead.")
+        return asyncio.run_coroutine_threadsafe(async_fn(*args, **kwargs), loop).result()
+
+    async def run_once():
+        client = AsyncLMStudioClient()
+        try:
+            return await async_fn(*args, client=client, **kwargs)
+        finally:
+            await client.close()
+    return asyncio.run(run_once())
+
+# The *_async functions queue on the LLM scheduler before touching LMStudio.
+# A job given max_wait raises JobDropped if it has not started in time, and
+# background/reaction jobs are refused outright when their queue is full.
+
+# Calls marked cacheable are answered from the response cache when the same
+# model, system message, prompt and temperature were seen before.
+
+async def chat_completion_async(prompt: str, system_message: str = "You are chode the chatbot.", timeout=None,
+                                priority=PRIORITY_INTERACTIVE, max_wait=None, client=None,
+                                cacheable=False, cache_ttl=response_cache.RESPONSE_CACHE_TTL,
+                                temperature=None) -> str:
+    if cacheable:
+        key = response_cache.make_key(CHAT_MODEL, system_message, prompt, temperature)
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return cached
+    async with llm_scheduler.slot(priority, max_wait):
+        response = await (client or _client).chat_completion(prompt, system_message=system_message,
+                                                             timeout=timeout, temperature=temperature)
+    if cacheable and not is_error_reply(response):
+        response_cache.put(key, response, cache_ttl)
+    return response
+
+async def chat_async(messages, timeout=None, priority=PRIORITY_INTERACTIVE, max_wait=None, client=None) -> str:
+    """Multi-turn variant of chat_completion_async taking a full list of chat messages."""
+    async with llm_scheduler.slot(priority, max_wait):
+        return await (client or _client).chat(messages, timeout=timeout)
+
+async def stream_chat_async(messages, timeout=None, priority=PRIORITY_INTERACTIVE, max_wait=None, client=None):
+    """Async iterator over the reply's content deltas; holds its scheduler slot until the stream ends."""
+    async with llm_scheduler.slot(priority, max_wait):
+        async for delta in (client or _client).stream_chat(messages, timeout=timeout):
+            yield delta
+
+def stream_chat_completion_async(prompt: str, system_message: str = "You are chode the chatbot.", timeout=None,
+                                 priority=PRIORITY_INTERACTIVE, max_wait=None, client=None):
+    return stream_chat_async(_messages(prompt, system_message), timeout=timeout, priority=priority,
+                             max_wait=max_wait, client=client)
+
+async def get_embeddings_async(text, timeout=None, priority=PRIORITY_INTERACTIVE, max_wait=None, client=None):
+    async with llm_scheduler.slot(priority, max_wait):
+        return await (client or _client).get_embeddings(text, timeout=timeout)
+
+async def call_lmstudio_async(prompt: str, timeout=None, priority=PRIORITY_INTERACTIVE, max_wait=None,
+                              cacheable=False, temperature=None) -> str:
+    return await chat_completion_async(prompt, timeout=timeout, priority=priority, max_wait=max_wait,
+                                       cacheable=cacheable, temperature=temperature)
+
+def _personality_for(guild_id):
     # Attempt to load personality configuration for the given guild.
     try:
         conf = config.load_server_config(guild_id)
     except Exception as e:
         conf = {}
     # Use a default personality if none is found.
-    personality = conf.get("personality", "You are chode, a friendly chatbot.")
+    return conf.get("personality", "You are chode, a friendly chatbot.")
+
+async def call_lmstudio_with_personality_async(prompt: str, guild_id: str, timeout=None) -> str:
     # Use the personality as the system message.
-    return chat_completion(prompt, system_message=personality)
+    return await chat_completion_async(prompt, system_message=_personality_for(guild_id), timeout=timeout)
+
+async def list_models_async(client=None):
+    """List available models from LMStudio (the least busy backend)."""
+    try:
+        return await (client or _client).list_models()
+    except Exception as e:
+        return f"Error fetching models: {e}"
+
+async def close_client():
+    await _client.close()
+
+def backend_stats():
+    """Returns per-backend outstanding requests, health, failures and advertised models."""
+    return _client.pool.stats()
+
+def breaker_stats():
+    """Returns the circuit breaker's state, failure streak and how often it opened or refused calls."""
+    return _client.breaker.stats()
+
+def list_models():
+    """List available models from LMStudio."""
+    return _run_sync(list_models_async)
+
+def chat_completion(prompt: str, system_message: str = "You are chode the chatbot.",
+                    priority=PRIORITY_INTERACTIVE, cacheable=False) -> str:
+    return _run_sync(chat_completion_async, prompt, system_message=system_message, priority=priority,
+                     cacheable=cacheable)
+
+def get_embeddings(text, priority=PRIORITY_INTERACTIVE):
+    """
+    Retrieve embeddings for a string or a list of strings using LMStudio.
+    Returns the response's "data" list, or an error string on failure.
+    """
+    return _run_sync(get_embeddings_async, text, priority=priority)
+
+def call_lmstudio(prompt: str, priority=PRIORITY_INTERACTIVE, cacheable=False) -> str:
+    return chat_completion(prompt, priority=priority, cacheable=cacheable)
+
+def call_lmstudio_with_personality(prompt: str, guild_id: str) -> str:
+    return chat_completion(prompt, system_message=_personality_for(guild_id))
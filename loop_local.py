@@ -0,0 +1,28 @@
+import asyncio
+import weakref
+
+class PerLoop:
+    """
+    Holds one instance of a component per event loop, built by `factory` on
+    first use. The bot's loop is the one that matters; a benchmark or a
+    blocking helper running its own loop gets a separate instance.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._instances = weakref.WeakKeyDictionary()
+
+    def get(self):
+        """Returns the running loop's instance, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        instance = self._instances.get(loop)
+        if instance is None:
+            instance = self.factory()
+            self._instances[loop] = instance
+        return instance
+
+    def existing(self):
+        """Returns an instance already created on any loop, or None. Safe from worker threads, e.g. for stats."""
+        for instance in list(self._instances.values()):
+            return instance
+        return None
@@ -3,6 +3,7 @@ from discord.ext import commands
 import os
 from dotenv import load_dotenv
 from chode import commands as chode_commands
+from chode import comfyui, config, lmstudio, retention, semantic, warmup, workflows
 
 # Load environment variables
 load_dotenv()
@@ -17,11 +18,31 @@ intents.members = True
 intents.presences = True
 intents.voice_states = True
 
+class ChodeBot(commands.Bot):
+    async def close(self):
+        # Disconnect from Discord first, then close the LMStudio and ComfyUI sessions.
+        try:
+            await super().close()
+        finally:
+            await lmstudio.close_client()
+            await comfyui.close_client()
+
 # Create the bot instance; allow invocation by prefix "!!" or by mentioning the bot.
-bot = commands.Bot(command_prefix=commands.when_mentioned_or("!!"), intents=intents)
+bot = ChodeBot(command_prefix=commands.when_mentioned_or("!!"), intents=intents)
 
 # Register commands and event handlers from our commands module
 chode_commands.setup_commands(bot)
 
+# Pick up server configs edited outside the bot.
+config.start_config_watcher()
+# Reload ComfyUI workflows edited on disk.
+workflows.start_workflow_watcher()
+# Archive and prune old memories in the background.
+retention.start_retention_worker()
+# Embed stored memories in the background for semantic recall.
+semantic.start_embedding_worker()
+# Load the LMStudio and ComfyUI models before the first request needs them.
+warmup.start_warmup_worker()
+
 # Run the bot
 bot.run(TOKEN)
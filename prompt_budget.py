@@ -0,0 +1,124 @@
+import re
+import os
+import threading
+from collections import deque
+
+# Context window per model name, in tokens; "default" covers unknown models.
+MODEL_CONTEXT_TOKENS = {
+    "default": 4096,
+}
+REPLY_RESERVE_TOKENS = 512  # Kept free for the model's answer.
+# Optional Hugging Face tokenizer.json for exact counts; needs the tokenizers package.
+TOKENIZER_PATH = "tokenizer.json"
+PROMPT_SAMPLES = 500        # Recent prompts kept for prompt_stats().
+MESSAGE_OVERHEAD_TOKENS = 4 # Role markers the chat template adds around each message.
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+_tokenizer = None
+_tokenizer_checked = False
+_samples = deque(maxlen=PROMPT_SAMPLES)  # (prompt_tokens, first_token_seconds, total_seconds)
+_stats_lock = threading.Lock()
+_counts = {"prompts": 0, "truncated": 0}
+
+def _load_tokenizer():
+    global _tokenizer, _tokenizer_checked
+    _tokenizer_checked = True
+    if not TOKENIZER_PATH or not os.path.exists(TOKENIZER_PATH):
+        return
+    try:
+        from tokenizers import Tokenizer
+        _tokenizer = Tokenizer.from_file(TOKENIZER_PATH)
+    except Exception as e:
+        print(f"[DEBUG] Could not load tokenizer from {TOKENIZER_PATH}, using the estimate: {e}")
+
+def count_tokens(text):
+    """Token count from tokenizer.json when available, otherwise a quick estimate."""
+    if not _tokenizer_checked:
+        _load_tokenizer()
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    # Words average a little over one BPE token and punctuation is usually its own.
+    words = 0
+    other = 0
+    for piece in _PIECE.findall(text):
+        if piece[0].isalnum() or piece[0] == "_":
+            words += 1 + len(piece) // 8
+        else:
+            other += 1
+    return int(words * 1.2) + other
+
+def count_message_tokens(messages):
+    """Token count for a list of chat messages, including per-message template overhead."""
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def prompt_limit(model="default"):
+    """Tokens available to the prompt once the reply reserve is taken out."""
+    context = MODEL_CONTEXT_TOKENS.get(model, MODEL_CONTEXT_TOKENS["default"])
+    return max(context - REPLY_RESERVE_TOKENS, 0)
+
+class Section:
+    """One piece of a prompt. Lower priority values are budgeted first; a section that does not fit is dropped whole."""
+
+    def __init__(self, text, priority):
+        self.text = text
+        self.priority = priority
+
+def trim_text(text, budget):
+    """Cuts text from the end until it fits the budget, keeping a trailing newline."""
+    ending = "\n" if text.endswith("\n") else ""
+    text = text[:len(text) - len(ending)]
+    # Shrink proportionally until the estimate fits; converges in a step or two.
+    while text and count_tokens(text) > budget:
+        text = text[:int(len(text) * budget / count_tokens(text) * 0.95)]
+    return text + ending if text else ""
+
+def fit_sections(sections, limit):
+    """
+    Joins sections in the order given, dropping them by priority so the
+    result fits in `limit` tokens. Returns (text, truncated).
+    """
+    remaining = limit
+    texts = [""] * len(sections)
+    truncated = False
+    for index in sorted(range(len(sections)), key=lambda i: sections[i].priority):
+        section = sections[index]
+        cost = count_tokens(section.text)
+        if cost <= remaining:
+            texts[index] = section.text
+            remaining -= cost
+        else:
+            truncated = True
+    return "".join(texts), truncated
+
+def record_prompt(truncated):
+    with _stats_lock:
+        _counts["prompts"] += 1
+        if truncated:
+            _counts["truncated"] += 1
+
+def record_reply(prompt_tokens, first_token_seconds, total_seconds):
+    """Records how long a reply took for a prompt of the given size."""
+    with _stats_lock:
+        _samples.append((prompt_tokens, first_token_seconds, total_seconds))
+
+def prompt_stats():
+    """Prompt counts plus average prompt size and latency per prompt-size bucket."""
+    with _stats_lock:
+        samples = list(_samples)
+        stats = dict(_counts)
+    buckets = {}
+    for tokens, first, total in samples:
+        upper = 512
+        while tokens > upper:
+            upper *= 2
+        bucket = buckets.setdefault(f"<={upper}", [0, 0.0, 0.0])
+        bucket[0] += 1
+        bucket[1] += first
+        bucket[2] += total
+    stats["avg_prompt_tokens"] = round(sum(s[0] for s in samples) / len(samples), 1) if samples else 0.0
+    stats["max_prompt_tokens"] = max((s[0] for s in samples), default=0)
+    stats["latency_by_prompt_tokens"] = {
+        name: {"replies": n, "avg_first_token_s": round(first / n, 3), "avg_total_s": round(total / n, 3)}
+        for name, (n, first, total) in sorted(buckets.items(), key=lambda item: int(item[0][2:]))
+    }
+    return stats
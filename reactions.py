@@ -0,0 +1,210 @@
+import re
+import json
+import random
+import asyncio
+from collections import OrderedDict, deque
+from chode.lmstudio import call_lmstudio_async
+from chode.llm_scheduler import PRIORITY_REACTION, JobDropped
+from chode.loop_local import PerLoop
+
+# Candidate messages are collected for up to REACTION_BATCH_WINDOW seconds, or
+# until REACTION_BATCH_SIZE distinct texts are waiting, then classified with a
+# single LLM request.
+REACTION_BATCH_SIZE = 20
+REACTION_BATCH_WINDOW = 5.0
+REACTION_TEXT_CHARS = 300   # Each message is cut to this length inside the batch prompt.
+# A batch that cannot get an LLM slot within this many seconds is no longer worth reacting to.
+REACTION_MAX_WAIT = 15
+
+# Local pre-filter: messages scoring below REACTION_SCORE_THRESHOLD never reach the LLM.
+REACTION_SAMPLE_RATE = 0.1          # Share of passing messages that are actually classified.
+REACTION_SCORE_THRESHOLD = 0.5
+REACTION_NOVELTY_WINDOW = 20        # Recent texts remembered per channel for the repeat check.
+REACTION_NOVELTY_CHANNELS = 1024
+# Optional linear model on disk: {"bias": float, "words": {"word": weight, ...}}.
+REACTION_WEIGHTS_PATH = "reaction_weights.json"
+
+_NOISE = re.compile(r"https?://\S+|<a?:\w+:\d+>|<[@#][!&]?\d+>")
+_WORD = re.compile(r"[a-z0-9']+")
+_EMOJI = re.compile("[\U0001F300-\U0001FAFF\u2600-\u27BF]")
+# Words that tend to come with messages people react to.
+LEXICON = {
+    "lol", "lmao", "haha", "omg", "wow", "amazing", "awesome", "insane", "congrats", "congratulations",
+    "love", "hate", "finally", "won", "win", "lost", "birthday", "happy", "sad", "rip", "hype", "wtf",
+    "best", "worst", "funny", "cute", "crazy", "excited", "new", "thanks", "legend", "gg",
+}
+
+def _load_weights(path):
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return float(data.get("bias", 0.0)), {word.lower(): float(w) for word, w in data.get("words", {}).items()}
+    except FileNotFoundError:
+        return 0.0, {}
+    except Exception as e:
+        print(f"[DEBUG] Could not load reaction weights from {path}: {e}")
+        return 0.0, {}
+
+_weight_bias, _weights = _load_weights(REACTION_WEIGHTS_PATH)
+_recent_texts = OrderedDict()  # Key: channel id, Value: deque of recent normalised texts
+_filter_stats = {"seen": 0, "filtered": 0, "sampled": 0, "llm_calls_avoided": 0}
+
+def score_message(message):
+    """
+    Scores how likely a message is to deserve a reaction, from 0 to 1, without
+    touching the LLM. Links, emotes and mentions are ignored; bot messages,
+    empty or single-word text and repeats of recent channel messages score low.
+    """
+    if getattr(message.author, "bot", False):
+        return 0.0
+    stripped = _NOISE.sub(" ", message.content.lower())
+    words = _WORD.findall(stripped)
+    key = " ".join(words)
+    history = _recent_texts.get(message.channel.id)
+    if history is None:
+        history = _recent_texts[message.channel.id] = deque(maxlen=REACTION_NOVELTY_WINDOW)
+        if len(_recent_texts) > REACTION_NOVELTY_CHANNELS:
+            _recent_texts.popitem(last=False)
+    else:
+        _recent_texts.move_to_end(message.channel.id)
+    repeated = key in history
+    history.append(key)
+    if len(words) < 2 or len(set(words)) == 1:
+        return 0.0
+    score = 0.3 + min(len(words), 20) / 40
+    if any(word in LEXICON for word in words):
+        score += 0.2
+    if _EMOJI.search(message.content) or "!" in stripped or "?" in stripped:
+        score += 0.1
+    if _weights:
+        score += _weight_bias + sum(_weights.get(word, 0.0) for word in words)
+    if repeated:
+        score *= 0.2
+    return max(0.0, min(1.0, score))
+
+def consider(message):
+    """Queues the message for classification if it passes the pre-filter and the sampling draw."""
+    _filter_stats["seen"] += 1
+    passed = score_message(message) >= REACTION_SCORE_THRESHOLD
+    if random.random() > REACTION_SAMPLE_RATE:
+        if not passed:
+            _filter_stats["filtered"] += 1
+        return
+    if not passed:
+        _filter_stats["filtered"] += 1
+        _filter_stats["llm_calls_avoided"] += 1
+        return
+    _filter_stats["sampled"] += 1
+    queue_reaction(message)
+
+_ANSWER_LINE = re.compile(r"^\s*(\d+)\s*[:.)\-]\s*(\S+)")
+
+def build_batch_prompt(texts):
+    lines = [f"{i}: {' '.join(text.split())[:REACTION_TEXT_CHARS]}" for i, text in enumerate(texts, 1)]
+    return (
+        "For each numbered chat message below, suggest one reaction emoji that best expresses an "
+        "appropriate reaction to it, or 'none' if the message is not interesting.\n\n"
+        + "\n".join(lines)
+        + "\n\nAnswer with exactly one line per message in the form '<number>: <emoji or none>' "
+        "and nothing else."
+    )
+
+def parse_batch_reply(reply, count):
+    """Maps message numbers (1-based) to emoji. Missing, out of range and 'none' answers are left out."""
+    reactions = {}
+    for line in reply.splitlines():
+        match = _ANSWER_LINE.match(line)
+        if not match:
+            continue
+        number, reaction = int(match.group(1)), match.group(2).strip("'\"`*")
+        if 1 <= number <= count and reaction and reaction.lower() != "none":
+            reactions.setdefault(number, reaction)
+    return reactions
+
+class ReactionBatcher:
+    """
+    Micro-batches reaction candidates. Messages with identical text share one
+    slot in the prompt and get the same reaction.
+    """
+
+    def __init__(self, batch_size=REACTION_BATCH_SIZE, window=REACTION_BATCH_WINDOW):
+        self.batch_size = batch_size
+        self.window = window
+        self._pending = OrderedDict()  # Key: normalised text, Value: list of messages
+        self._timer = None
+        self._tasks = set()
+        self.stats = {"messages": 0, "deduplicated": 0, "batches": 0, "llm_calls": 0,
+                      "reactions": 0, "dropped": 0}
+
+    def submit(self, message):
+        key = " ".join(message.content.split()).lower()
+        self.stats["messages"] += 1
+        if key in self._pending:
+            self._pending[key].append(message)
+            self.stats["deduplicated"] += 1
+            return
+        self._pending[key] = [message]
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self._flush(self._take())
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._spawn(self._flush(self._take()))
+
+    def _take(self):
+        batch = list(self._pending.values())
+        self._pending = OrderedDict()
+        return batch
+
+    async def _flush(self, batch):
+        if not batch:
+            return
+        self.stats["batches"] += 1
+        texts = [messages[0].content for messages in batch]
+        try:
+            self.stats["llm_calls"] += 1
+            reply = await call_lmstudio_async(build_batch_prompt(texts), priority=PRIORITY_REACTION,
+                                              max_wait=REACTION_MAX_WAIT)
+        except JobDropped as e:
+            self.stats["dropped"] += len(batch)
+            print(f"[DEBUG] Skipping {len(batch)} reactions: {e}")
+            return
+        for number, reaction in parse_batch_reply(reply, len(batch)).items():
+            for message in batch[number - 1]:
+                try:
+                    await message.add_reaction(reaction)
+                    self.stats["reactions"] += 1
+                except Exception as e:
+                    print(f"[DEBUG] Error adding reaction: {e}")
+
+_batchers = PerLoop(ReactionBatcher)
+
+def get_batcher():
+    return _batchers.get()
+
+def queue_reaction(message):
+    """Adds a message to the current reaction batch; must be called on the bot's loop."""
+    get_batcher().submit(message)
+
+def reaction_stats():
+    """Returns pre-filter counters plus message, batch and LLM call counts for the reaction pipeline."""
+    stats = {"filter": dict(_filter_stats)}
+    batcher = _batchers.existing()
+    if batcher is not None:
+        stats.update(batcher.stats)
+    return stats
@@ -0,0 +1,116 @@
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_SIZE = 1024            # Entries kept in memory.
+RESPONSE_CACHE_TTL = 24 * 3600        # Default seconds an entry stays valid.
+# SQLite file backing the in-memory layer so cached replies survive restarts; None disables it.
+RESPONSE_CACHE_PATH = "llm_cache.db"
+
+_memory = OrderedDict()  # Key: request hash, Value: (expires_at, response)
+_lock = threading.Lock()
+# The SQLite tier is only touched from worker threads, under its own lock, so a
+# lookup on the event loop never waits for disk I/O.
+_disk = None
+_disk_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def make_key(model, system_message, prompt, temperature=None):
+    """Hashes everything that determines a completion."""
+    digest = hashlib.sha256()
+    for part in (model, system_message, prompt, repr(temperature)):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _disk_connection():
+    global _disk
+    if _disk is None and RESPONSE_CACHE_PATH:
+        _disk = sqlite3.connect(RESPONSE_CACHE_PATH, check_same_thread=False)
+        _disk.execute("PRAGMA journal_mode=WAL")
+        with _disk:
+            _disk.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            ''')
+            _disk.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+    return _disk
+
+def _remember(key, expires_at, response):
+    _memory[key] = (expires_at, response)
+    _memory.move_to_end(key)
+    while len(_memory) > RESPONSE_CACHE_SIZE:
+        _memory.popitem(last=False)
+        _stats["evictions"] += 1
+
+def _disk_get(key, now):
+    with _disk_lock:
+        disk = _disk_connection()
+        if disk is None:
+            return None
+        return disk.execute(
+            "SELECT response, expires_at FROM responses WHERE key=? AND expires_at > ?", (key, now)
+        ).fetchone()
+
+def _disk_put(key, response, expires_at):
+    try:
+        with _disk_lock:
+            disk = _disk_connection()
+            if disk is not None:
+                with disk:
+                    disk.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)",
+                        (key, response, expires_at)
+                    )
+    except Exception as e:
+        print(f"[DEBUG] Error writing response cache entry to disk: {e}")
+
+async def get(key):
+    """Returns the cached response for a key, or None if missing or expired. Disk lookups run in a worker thread."""
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _memory.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[1]
+            del _memory[key]
+    row = await asyncio.to_thread(_disk_get, key, now) if RESPONSE_CACHE_PATH else None
+    with _lock:
+        if row is not None:
+            _remember(key, row[1], row[0])
+            _stats["disk_hits"] += 1
+            return row[0]
+        _stats["misses"] += 1
+        return None
+
+def put(key, response, ttl=RESPONSE_CACHE_TTL):
+    """Stores a response in memory at once and hands the disk copy to a worker thread. Call from the event loop."""
+    expires_at = time.time() + ttl
+    with _lock:
+        _remember(key, expires_at, response)
+        _stats["stores"] += 1
+    if RESPONSE_CACHE_PATH:
+        asyncio.get_running_loop().run_in_executor(None, _disk_put, key, response, expires_at)
+
+def clear():
+    with _lock:
+        _memory.clear()
+    with _disk_lock:
+        disk = _disk_connection()
+        if disk is not None:
+            with disk:
+                disk.execute("DELETE FROM responses")
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_memory)
+        return stats
@@ -0,0 +1,183 @@
+import os
+import json
+import zlib
+import time
+import datetime
+import threading
+from chode import config, database, semantic
+
+# Default policy; a guild can override either value with a "retention" entry in its
+# server config, e.g. {"retention": {"max_age_days": 30, "max_rows_per_channel": 2000}}.
+# A value of 0 disables that limit.
+DEFAULT_MAX_AGE_DAYS = 180
+DEFAULT_MAX_ROWS_PER_CHANNEL = 20000
+
+ARCHIVE_DIR = "archive"
+RETENTION_INTERVAL = 3600      # Seconds between retention passes.
+ARCHIVE_BATCH_SIZE = 2000      # Rows moved per hot-database transaction.
+BATCH_PAUSE = 0.05             # Pause between batches so the memory writer is never starved.
+VACUUM_PAGES_PER_STEP = 1000   # Pages released per incremental_vacuum step.
+
+_stats = {
+    "passes": 0,
+    "archived": 0,
+    "vacuumed_pages": 0,
+    "last_pass_seconds": 0.0,
+    "last_pass_at": None,
+}
+
+def get_policy(server_key):
+    """Returns (max_age_days, max_rows_per_channel) for an encoded server id."""
+    policy = {}
+    # DM conversations (negative ids) have no server config and use the defaults.
+    if server_key > 0:
+        try:
+            policy = config.load_server_config(server_key).get("retention", {}) or {}
+        except Exception as e:
+            print(f"[DEBUG] Could not load retention policy for {server_key}: {e}")
+    return (
+        int(policy.get("max_age_days", DEFAULT_MAX_AGE_DAYS)),
+        int(policy.get("max_rows_per_channel", DEFAULT_MAX_ROWS_PER_CHANNEL)),
+    )
+
+def _archive_path(ts):
+    month = datetime.datetime.fromtimestamp(ts / 1000, datetime.timezone.utc).strftime("%Y-%m")
+    return os.path.join(ARCHIVE_DIR, f"memories-{month}.db")
+
+def _open_archive(path, archives):
+    connection = archives.get(path)
+    if connection is None:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        connection = database.connect(path)
+        # Each row is one zlib-compressed JSON list of [id, user_id, message, ts]
+        # rows from a single channel, ordered by ts.
+        connection.execute('''
+        CREATE TABLE IF NOT EXISTS archived_chunks (
+            server_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )
+        ''')
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS archived_chunks_idx ON archived_chunks (server_id, channel_id, first_ts)"
+        )
+        connection.commit()
+        archives[path] = connection
+    return connection
+
+def _cutoff_ts(connection, server_key, channel_key, now_ms):
+    """Returns the ts below which a channel's rows should leave the hot database, or None."""
+    max_age_days, max_rows = get_policy(server_key)
+    cutoff = None
+    if max_age_days > 0:
+        cutoff = now_ms - max_age_days * 86400000
+    if max_rows > 0:
+        row = connection.execute(
+            "SELECT ts FROM memories WHERE server_id=? AND channel_id=? ORDER BY ts DESC LIMIT 1 OFFSET ?",
+            (server_key, channel_key, max_rows - 1)
+        ).fetchone()
+        if row is not None:
+            cutoff = row[0] if cutoff is None else max(cutoff, row[0])
+    return cutoff
+
+def _archive_channel(connection, archives, server_key, channel_key, cutoff, deleted_ids):
+    moved = 0
+    while True:
+        rows = connection.execute(
+            "SELECT id, user_id, message, ts FROM memories WHERE server_id=? AND channel_id=? AND ts < ? ORDER BY ts LIMIT ?",
+            (server_key, channel_key, cutoff, ARCHIVE_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(_archive_path(row[3]), []).append(row)
+        # Archive first, delete second: a crash in between can only duplicate rows, never lose them.
+        for path, chunk in partitions.items():
+            archive = _open_archive(path, archives)
+            payload = zlib.compress(json.dumps(chunk).encode("utf-8"), 9)
+            with archive:
+                archive.execute(
+                    "INSERT INTO archived_chunks (server_id, channel_id, first_ts, last_ts, row_count, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                    (server_key, channel_key, chunk[0][3], chunk[-1][3], len(chunk), payload)
+                )
+        with connection:
+            connection.executemany("DELETE FROM memories WHERE id=?", [(row[0],) for row in rows])
+        deleted_ids.extend(row[0] for row in rows)
+        moved += len(rows)
+        time.sleep(BATCH_PAUSE)
+    if moved:
+        database.forget_cached_conversation(server_key, channel_key)
+    return moved
+
+def _incremental_vacuum(connection):
+    # 2 is INCREMENTAL; in any other mode incremental_vacuum is a no-op and the
+    # free list would never shrink.
+    mode = connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        print(f"[DEBUG] memories.db is not in incremental auto_vacuum mode ({mode}), skipping compaction.")
+        return 0
+    free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+    remaining = free_pages
+    while remaining > 0:
+        connection.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+        previous, remaining = remaining, connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= previous:
+            print(f"[DEBUG] Incremental vacuum stopped making progress with {remaining} free pages left.")
+            break
+        time.sleep(BATCH_PAUSE)
+    return free_pages - remaining
+
+def run_retention_pass():
+    """Moves expired rows into the monthly archive databases and compacts memories.db."""
+    start = time.perf_counter()
+    connection = database.connect()
+    archives = {}
+    archived = 0
+    deleted = {}  # Key: server_id, Value: ids of the memories moved out, for the semantic index
+    try:
+        now_ms = int(time.time() * 1000)
+        channels = connection.execute("SELECT DISTINCT server_id, channel_id FROM memories").fetchall()
+        for server_key, channel_key in channels:
+            cutoff = _cutoff_ts(connection, server_key, channel_key, now_ms)
+            if cutoff is not None:
+                archived += _archive_channel(connection, archives, server_key, channel_key, cutoff,
+                                             deleted.setdefault(server_key, []))
+        released = _incremental_vacuum(connection)
+    finally:
+        for archive in archives.values():
+            archive.close()
+        connection.close()
+    for server_key, memory_ids in deleted.items():
+        try:
+            semantic.forget_memories(server_key, memory_ids)
+        except Exception as e:
+            print(f"[DEBUG] Could not prune the semantic index for {server_key}: {e}")
+    elapsed = time.perf_counter() - start
+    _stats["passes"] += 1
+    _stats["archived"] += archived
+    _stats["vacuumed_pages"] += released
+    _stats["last_pass_seconds"] = round(elapsed, 3)
+    _stats["last_pass_at"] = datetime.datetime.utcnow().isoformat()
+    print(f"[DEBUG] Retention pass archived {archived} memories in {elapsed:.2f}s.")
+    return archived
+
+def retention_stats():
+    return dict(_stats)
+
+def _retention_loop():
+    while True:
+        try:
+            run_retention_pass()
+        except Exception as e:
+            print(f"[DEBUG] Error during retention pass: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+def start_retention_worker():
+    """Starts the background retention thread."""
+    thread = threading.Thread(target=_retention_loop, name="memory-retention", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,108 @@
+import re
+from chode import database
+
+SEARCH_PAGE_SIZE = 10
+KEYWORD_CONTEXT_LIMIT = 3
+MIN_TERM_LENGTH = 3
+KEYWORD_LOOKUP_TERMS = 8     # Longest terms of a message whose document counts are looked up.
+KEYWORD_MAX_TERMS = 4        # Rarest of those kept for keyword recall.
+KEYWORD_MAX_TERM_DOCS = 2000 # Terms in more stored messages than this are too common to rank by.
+
+# Words so common they match a large share of any guild's history. Besides
+# adding nothing to relevance, each one makes BM25 rank that many more rows.
+STOPWORDS = frozenset("""
+    the and you are for not but was with this that have has had what when where who why how
+    can could would should will just like about from they them their there then than your yours
+    our ours its it's all any some one out get got did does doing done been being were into over
+    also too very really still even yeah yes nah lol lmao okay hey please thanks thank know think
+    want need going make made say said tell told see look here now well much many more most
+    chode
+""".split())
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+def search_terms(text, max_terms=None):
+    """The distinct non-stopword terms of a text, in order; with max_terms only that many of the longest."""
+    terms = [term for term in _TERM_RE.findall(text.lower())
+             if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS]
+    # Keep the order but drop duplicates.
+    terms = list(dict.fromkeys(terms))
+    if max_terms is not None and len(terms) > max_terms:
+        longest = set(sorted(terms, key=len, reverse=True)[:max_terms])
+        terms = [term for term in terms if term in longest]
+    return terms
+
+def build_match_query(text):
+    """
+    Turns free text into an FTS5 MATCH expression. Every term is quoted so user
+    input can never be parsed as FTS syntax; terms are OR-ed and BM25 ranks rows
+    that match more (and rarer) terms first.
+    """
+    return " OR ".join(f'"{term}"' for term in search_terms(text))
+
+def rare_terms(terms, limit=KEYWORD_MAX_TERMS, max_docs=KEYWORD_MAX_TERM_DOCS):
+    """
+    Keeps the terms found in at most max_docs stored messages, rarest first, so
+    ranking their matches stays cheap however long the history grows.
+    """
+    connection = database.read_connection()
+    counted = []
+    for term in terms:
+        row = connection.execute("SELECT doc FROM memories_fts_vocab WHERE term = ?", (term,)).fetchone()
+        docs = row[0] if row else 0
+        if docs <= max_docs:
+            counted.append((docs, term))
+    return [term for _, term in sorted(counted)[:limit]]
+
+def search_memories(text, server_id, channel_id=None, user_id=None, limit=SEARCH_PAGE_SIZE, offset=0,
+                    channel_ids=None):
+    """
+    Full-text search over stored memories of one server (or DM namespace),
+    optionally narrowed to a channel and/or a user. `channel_ids`, when given,
+    limits results to those channels (e.g. the ones the caller may read), so
+    limit/offset page through visible rows only. Results are BM25-ranked dicts.
+    Blocking; call it through asyncio.to_thread from the event loop.
+    """
+    match = build_match_query(text)
+    if not match or (channel_ids is not None and not channel_ids):
+        return []
+    sql = (
+        "SELECT m.id, m.channel_id, m.user_id, m.message, m.ts, bm25(memories_fts) AS score "
+        "FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid "
+        "WHERE memories_fts MATCH ? AND m.server_id = ?"
+    )
+    params = [match, database.encode_server_id(server_id)]
+    if channel_id is not None:
+        sql += " AND m.channel_id = ?"
+        params.append(int(channel_id))
+    if user_id is not None:
+        sql += " AND m.user_id = ?"
+        params.append(int(user_id))
+    if channel_ids is not None:
+        sql += f" AND m.channel_id IN ({','.join('?' for _ in channel_ids)})"
+        params.extend(int(channel) for channel in channel_ids)
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+    rows = database.read_connection().execute(sql, params).fetchall()
+    return [
+        {"id": row[0], "channel_id": row[1], "user_id": row[2], "message": row[3], "ts": row[4], "score": row[5]}
+        for row in rows
+    ]
+
+def keyword_context(server_id, text, limit=KEYWORD_CONTEXT_LIMIT, exclude="", channel_ids=None):
+    """
+    Returns the best keyword matches as history lines, skipping lines already in
+    `exclude` and, when `channel_ids` is given, rows from any other channel.
+    Only the message's rare terms are searched; with none there is no result.
+    """
+    terms = rare_terms(search_terms(text, KEYWORD_LOOKUP_TERMS))
+    if not terms:
+        return ""
+    lines = []
+    for result in search_memories(" ".join(terms), server_id, limit=limit * 2, channel_ids=channel_ids):
+        line = database.format_memory_line(result["user_id"], result["message"], result["ts"])
+        if line not in exclude and line not in lines:
+            lines.append(line)
+        if len(lines) >= limit:
+            break
+    return "".join(lines)
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+from chode import database, lmstudio
+from chode.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, JobDropped
+
+EMBEDDINGS_DIR = "embeddings"
+EMBED_BATCH_SIZE = 64        # Messages sent per /v1/embeddings request.
+EMBED_INTERVAL = 5.0         # Seconds the background embedder idles when caught up.
+MIN_EMBED_LENGTH = 12        # Shorter messages carry too little meaning to be worth recalling.
+EMBED_MAX_CHARS = 2000       # Longer messages are cut so they fit the embedding model's context.
+EMBED_PROBE_TEXT = "hello"   # Embedded after a failed batch to tell a bad row from an unreachable backend.
+SEMANTIC_TOP_K = 5
+SEMANTIC_MAX_CANDIDATES = 512  # Most nearest vectors examined when matches turn out deleted or hidden.
+MIN_SIMILARITY = 0.35        # Cosine similarity below which a match is not considered relevant.
+QUERY_CACHE_SIZE = 512
+# Recall runs before every mention or DM reply, so its query embedding gets a short
+# deadline and slot wait; past either the reply goes out without semantic memories.
+RECALL_EMBED_TIMEOUT = 5
+RECALL_MAX_WAIT = 2
+
+class GuildIndex:
+    """
+    Embedding index for one server (or DM namespace).
+    Unit-normalised float32 vectors are appended to <key>.f32 and the matching
+    memory ids to <key>.ids; both files are memory-mapped for searching.
+    remove() rewrites both through .tmp files when retention deletes memories.
+    """
+
+    def __init__(self, server_key, dim):
+        self.server_key = server_key
+        self.dim = dim
+        self.vectors_path = os.path.join(EMBEDDINGS_DIR, f"{server_key}.f32")
+        self.ids_path = os.path.join(EMBEDDINGS_DIR, f"{server_key}.ids")
+        self._lock = threading.Lock()
+        self._view = (np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32))
+        self._finish_rewrite()
+        self._remap()
+
+    def _finish_rewrite(self):
+        # remove() writes both .tmp files in full, then renames ids before vectors.
+        # A leftover vectors .tmp alone means the ids were already swapped: roll
+        # forward. Both left over means nothing was swapped: discard them.
+        vectors_tmp, ids_tmp = self.vectors_path + ".tmp", self.ids_path + ".tmp"
+        if os.path.exists(ids_tmp):
+            for path in (ids_tmp, vectors_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+        elif os.path.exists(vectors_tmp):
+            os.replace(vectors_tmp, self.vectors_path)
+
+    def _remap(self):
+        rows = 0
+        if os.path.exists(self.vectors_path) and os.path.exists(self.ids_path):
+            # A crash between the two appends can leave one file longer; trust the shorter one.
+            rows = min(os.path.getsize(self.vectors_path) // (4 * self.dim),
+                       os.path.getsize(self.ids_path) // 8)
+        if rows == 0:
+            self._view = (np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32))
+            return
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(rows,))
+        matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        self._view = (ids, matrix)
+
+    def __len__(self):
+        return len(self._view[0])
+
+    def append(self, ids, vectors):
+        with self._lock:
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self._remap()
+
+    def remove(self, memory_ids):
+        """Rewrites the index without the given memory ids. Returns how many vectors were dropped."""
+        with self._lock:
+            self._finish_rewrite()
+            ids, matrix = self._view
+            keep = ~np.isin(ids, np.fromiter(memory_ids, dtype=np.int64))
+            dropped = int(len(ids) - keep.sum())
+            if not dropped:
+                return 0
+            kept_ids = np.ascontiguousarray(ids[keep])
+            kept_vectors = np.ascontiguousarray(matrix[keep])
+            # Searches carry on against the in-memory copy; dropping the old maps
+            # lets the files be replaced on platforms that refuse to while mapped.
+            self._view = (kept_ids, kept_vectors)
+            del ids, matrix
+            with open(self.ids_path + ".tmp", "wb") as f:
+                f.write(kept_ids.tobytes())
+            with open(self.vectors_path + ".tmp", "wb") as f:
+                f.write(kept_vectors.tobytes())
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            self._remap()
+            return dropped
+
+    def search(self, query, k):
+        """Returns [(memory_id, score), ...] for the k most similar vectors."""
+        ids, matrix = self._view
+        if len(ids) == 0:
+            return []
+        scores = matrix @ query
+        if len(scores) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+_state = None
+_stats = {"embedded": 0, "skipped": 0, "query_cache_hits": 0, "query_cache_misses": 0,
+          "query_embed_failures": 0, "pruned": 0, "last_search_ms": 0.0}
+
+def _load_state():
+    global _state
+    if _state is None:
+        try:
+            with open(os.path.join(EMBEDDINGS_DIR, "state.json"), "r") as f:
+                _state = json.load(f)
+        except FileNotFoundError:
+            _state = {"last_id": 0, "dim": None}
+    return _state
+
+def _save_state(state):
+    path = os.path.join(EMBEDDINGS_DIR, "state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def _get_index(server_key, dim):
+    with _indexes_lock:
+        index = _indexes.get(server_key)
+        if index is None:
+            index = GuildIndex(server_key, dim)
+            _indexes[server_key] = index
+        return index
+
+def _unit_vectors(data, count):
+    """Turns an embeddings response for `count` inputs into an (n, dim) array of unit vectors, or None."""
+    if not isinstance(data, list) or len(data) != count:
+        print(f"[DEBUG] Embedding request failed: {data}")
+        return None
+    data = sorted(data, key=lambda item: item.get("index", 0))
+    vectors = np.asarray([item["embedding"] for item in data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _embed(texts, priority=PRIORITY_INTERACTIVE):
+    """Embeds a list of texts into an (n, dim) array of unit vectors, or returns None on failure. Blocking."""
+    return _unit_vectors(lmstudio.get_embeddings(texts, priority=priority), len(texts))
+
+def _embed_rows(rows):
+    """Embeds (id, server_id, message) rows. Returns [(row, vector), ...], or None if the batch failed."""
+    vectors = _embed([row[2][:EMBED_MAX_CHARS] for row in rows], priority=PRIORITY_BACKGROUND)
+    if vectors is None:
+        return None
+    return list(zip(rows, vectors))
+
+def _bisect_failed_rows(rows):
+    """
+    Re-embeds a batch that failed while the backend is up, halving it until the
+    rows the model rejects are isolated. Those are skipped; the rest are returned
+    as [(row, vector), ...].
+    """
+    if len(rows) == 1:
+        _stats["skipped"] += 1
+        print(f"[DEBUG] Skipping memory {rows[0][0]} for semantic recall, it could not be embedded.")
+        return []
+    embedded = []
+    middle = len(rows) // 2
+    for half in (rows[:middle], rows[middle:]):
+        pairs = _embed_rows(half)
+        embedded += _bisect_failed_rows(half) if pairs is None else pairs
+    return embedded
+
+def embed_pending(connection, state):
+    """Embeds the next batch of stored memories. Returns the number of rows consumed."""
+    rows = connection.execute(
+        "SELECT id, server_id, message FROM memories WHERE id > ? ORDER BY id LIMIT ?",
+        (state["last_id"], EMBED_BATCH_SIZE)
+    ).fetchall()
+    if not rows:
+        return 0
+    candidates = [row for row in rows if row[2] and len(row[2].strip()) >= MIN_EMBED_LENGTH]
+    embedded = []
+    if candidates:
+        embedded = _embed_rows(candidates)
+        if embedded is None:
+            if _embed([EMBED_PROBE_TEXT], priority=PRIORITY_BACKGROUND) is None:
+                # The backend is down rather than the batch bad; retry the batch later.
+                return 0
+            embedded = _bisect_failed_rows(candidates)
+    if embedded:
+        state["dim"] = state["dim"] or int(embedded[0][1].shape[0])
+        by_server = {}
+        for row, vector in embedded:
+            by_server.setdefault(row[1], ([], []))
+            by_server[row[1]][0].append(row[0])
+            by_server[row[1]][1].append(vector)
+        for server_key, (ids, server_vectors) in by_server.items():
+            _get_index(server_key, state["dim"]).append(ids, np.stack(server_vectors))
+        _stats["embedded"] += len(embedded)
+    state["last_id"] = rows[-1][0]
+    _save_state(state)
+    return len(rows)
+
+def _embedding_loop():
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    connection = database.read_connection()
+    state = _load_state()
+    while True:
+        try:
+            consumed = embed_pending(connection, state)
+        except Exception as e:
+            print(f"[DEBUG] Error embedding memories: {e}")
+            consumed = 0
+        if consumed < EMBED_BATCH_SIZE:
+            time.sleep(EMBED_INTERVAL)
+
+def start_embedding_worker():
+    """Starts the background thread that embeds new memories as they are stored."""
+    thread = threading.Thread(target=_embedding_loop, name="memory-embedder", daemon=True)
+    thread.start()
+    return thread
+
+async def _query_vector(text):
+    with _query_cache_lock:
+        vector = _query_cache.get(text)
+        if vector is not None:
+            _query_cache.move_to_end(text)
+            _stats["query_cache_hits"] += 1
+            return vector
+    _stats["query_cache_misses"] += 1
+    try:
+        data = await lmstudio.get_embeddings_async([text[:EMBED_MAX_CHARS]], timeout=RECALL_EMBED_TIMEOUT,
+                                                   max_wait=RECALL_MAX_WAIT)
+    except JobDropped:
+        data = None
+    vectors = _unit_vectors(data, 1)
+    if vectors is None:
+        _stats["query_embed_failures"] += 1
+        return None
+    with _query_cache_lock:
+        _query_cache[text] = vectors[0]
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vectors[0]
+
+async def recall(server_id, text, k=SEMANTIC_TOP_K, exclude="", channel_ids=None):
+    """
+    Returns formatted history lines for the stored memories most relevant to `text`.
+    Lines already present in `exclude` (e.g. the recent conversation) are skipped,
+    and so are rows outside `channel_ids` when it is given.
+    Returns nothing if the query cannot be embedded within RECALL_EMBED_TIMEOUT.
+    """
+    server_key = database.encode_server_id(server_id)
+    state = _load_state()
+    if not state.get("dim") or not text.strip():
+        return ""
+    # Opening an index the first time maps its files; keep that off the loop too.
+    index = await asyncio.to_thread(_get_index, server_key, state["dim"])
+    if len(index) == 0:
+        return ""
+    query = await _query_vector(text.strip())
+    if query is None or query.shape[0] != index.dim:
+        return ""
+    return await asyncio.to_thread(_search, index, query, k, exclude, channel_ids)
+
+def _search(index, query, k, exclude, channel_ids):
+    # Vectors can belong to memories that were deleted since, or to channels the
+    # caller may not quote, so widen the candidate set until k lines are found,
+    # the matches fall below MIN_SIMILARITY or SEMANTIC_MAX_CANDIDATES is reached.
+    start = time.perf_counter()
+    connection = database.read_connection()
+    candidates = k * 2
+    checked = set()
+    lines = []
+    while True:
+        found = index.search(query, candidates)
+        matches = [(memory_id, score) for memory_id, score in found if score >= MIN_SIMILARITY]
+        fresh = [memory_id for memory_id, _ in matches if memory_id not in checked]
+        rows = []
+        if fresh:
+            placeholders = ",".join("?" for _ in fresh)
+            rows = connection.execute(
+                f"SELECT id, user_id, message, ts, channel_id FROM memories WHERE id IN ({placeholders})", fresh
+            ).fetchall()
+        checked.update(fresh)
+        by_id = {row[0]: row for row in rows}
+        for memory_id, _ in matches:
+            row = by_id.get(memory_id)
+            if row is None or (channel_ids is not None and row[4] not in channel_ids):
+                continue
+            line = database.format_memory_line(row[1], row[2], row[3])
+            if line not in exclude and line not in lines:
+                lines.append(line)
+            if len(lines) >= k:
+                break
+        if (len(lines) >= k or len(matches) < len(found) or len(found) < candidates
+                or candidates >= SEMANTIC_MAX_CANDIDATES):
+            break
+        candidates = min(candidates * 4, SEMANTIC_MAX_CANDIDATES)
+    _stats["last_search_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return "".join(lines)
+
+def forget_memories(server_key, memory_ids):
+    """Drops deleted memories from a server's index so it does not grow without bound. Blocking."""
+    state = _load_state()
+    if not state.get("dim") or not memory_ids:
+        return 0
+    removed = _get_index(server_key, state["dim"]).remove(memory_ids)
+    _stats["pruned"] += removed
+    return removed
+
+def semantic_stats():
+    stats = dict(_stats)
+    stats["indexes"] = {key: len(index) for key, index in _indexes.items()}
+    return stats
@@ -0,0 +1,113 @@
+import time
+import asyncio
+import threading
+from chode import database, lmstudio, chat_prompt
+from chode.llm_scheduler import PRIORITY_BACKGROUND
+
+# Newest messages left out of the summary. History always sends at least
+# HISTORY_MIN_TURNS of them as chat turns, so summary and history leave no gap.
+RECENT_WINDOW = chat_prompt.HISTORY_MIN_TURNS
+SUMMARY_TRIGGER = 30        # New messages outside the window before the summary is refreshed.
+SUMMARY_MAX_FOLD = 200      # Most messages folded into the summary in one pass.
+SUMMARY_MAX_WORDS = 200
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain a running summary of a Discord conversation. "
+    "Merge the new messages into the existing summary and return only the updated summary, "
+    f"at most {SUMMARY_MAX_WORDS} words. Keep names, user ids, decisions, open questions and facts "
+    "people shared about themselves; drop small talk."
+)
+
+_summaries = {}        # Key: (server_id, channel_id), Value: (summary, last_id)
+_pending = {}          # Key: (server_id, channel_id), Value: messages seen since the last refresh
+_in_progress = set()
+_lock = threading.Lock()
+_stats = {"refreshes": 0, "failures": 0, "last_refresh_ms": 0.0}
+
+def _key(server_id, channel_id):
+    return (database.encode_server_id(server_id), int(channel_id))
+
+def _load(key):
+    with _lock:
+        entry = _summaries.get(key)
+    if entry is not None:
+        return entry
+    row = database.read_connection().execute(
+        "SELECT summary, last_id FROM summaries WHERE server_id=? AND channel_id=?", key
+    ).fetchone()
+    entry = (row[0], row[1]) if row else ("", 0)
+    with _lock:
+        _summaries.setdefault(key, entry)
+    return entry
+
+def get_summary(server_id, channel_id):
+    """Returns the running summary of everything before the recent window, or an empty string."""
+    return _load(_key(server_id, channel_id))[0]
+
+def note_message(server_id, channel_id):
+    """
+    Counts a newly stored message and schedules a background refresh once enough
+    messages have accumulated. Must be called from the event loop.
+    """
+    key = _key(server_id, channel_id)
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + 1
+        if _pending[key] < SUMMARY_TRIGGER or key in _in_progress:
+            return
+        _pending[key] = 0
+        _in_progress.add(key)
+    asyncio.create_task(_refresh_in_background(key))
+
+async def _refresh_in_background(key):
+    try:
+        await asyncio.to_thread(refresh_summary, key)
+    except Exception as e:
+        _stats["failures"] += 1
+        print(f"[DEBUG] Error refreshing summary for {key}: {e}")
+    finally:
+        with _lock:
+            _in_progress.discard(key)
+
+def refresh_summary(key):
+    """Folds messages older than the recent window into the stored summary. Blocking."""
+    # No flush: rows still queued in the memory writer are the newest ones, which the
+    # summary leaves out anyway, and they get higher ids than anything folded here.
+    summary, last_id = _load(key)
+    connection = database.read_connection()
+    rows = connection.execute(
+        "SELECT id, user_id, message, ts FROM memories WHERE server_id=? AND channel_id=? AND id > ? "
+        "ORDER BY ts DESC LIMIT -1 OFFSET ?",
+        (key[0], key[1], last_id, RECENT_WINDOW)
+    ).fetchall()
+    if not rows:
+        return
+    rows = list(reversed(rows))[:SUMMARY_MAX_FOLD]
+    new_lines = "".join(database.format_memory_line(row[1], row[2], row[3]) for row in rows)
+    prompt = (
+        f"Existing summary:\n{summary or '(none yet)'}\n\n"
+        f"New messages:\n{new_lines}"
+    )
+    start = time.perf_counter()
+    updated = lmstudio.chat_completion(
+        prompt, system_message=SUMMARY_SYSTEM_MESSAGE, priority=PRIORITY_BACKGROUND
+    ).strip()
+    if not updated or lmstudio.is_error_reply(updated):
+        _stats["failures"] += 1
+        print(f"[DEBUG] Summary refresh for {key} failed: {updated}")
+        return
+    new_last_id = rows[-1][0]
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO summaries (server_id, channel_id, summary, last_id, updated_ts) VALUES (?, ?, ?, ?, ?)",
+            (key[0], key[1], updated, new_last_id, int(time.time() * 1000))
+        )
+    with _lock:
+        _summaries[key] = (updated, new_last_id)
+    _stats["refreshes"] += 1
+    _stats["last_refresh_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+def summarizer_stats():
+    stats = dict(_stats)
+    stats["cached_summaries"] = len(_summaries)
+    stats["in_progress"] = len(_in_progress)
+    return stats
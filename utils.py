@@ -1,6 +1,8 @@
 import discord
 import asyncio
-from chode.lmstudio import call_lmstudio
+from chode.lmstudio import call_lmstudio, call_lmstudio_async
+from chode import reactions
+from chode.llm_scheduler import PRIORITY_REWORD
 
 def ordinal(n):
     if 11 <= (n % 100) <= 13:
@@ -9,21 +11,80 @@ def ordinal(n):
         suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
     return f"{n}{suffix}"
 
-def format_timestamp(timestamp_str):
+def format_timestamp(timestamp):
     import datetime
-    ts = datetime.datetime.fromisoformat(timestamp_str)
+    # Accepts epoch milliseconds (current schema) or an ISO-8601 string (legacy rows).
+    if isinstance(timestamp, (int, float)):
+        ts = datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc)
+    else:
+        ts = datetime.datetime.fromisoformat(timestamp)
     return f"{ts.strftime('%A')} the {ordinal(ts.day)} of {ts.strftime('%b').lower()}"
 
+# Streaming replies: the first message goes out once STREAM_FIRST_CHARS have arrived,
+# then it is edited in place at most once per STREAM_EDIT_INTERVAL seconds, which
+# stays inside Discord's per-channel edit rate limit.
+STREAM_FIRST_CHARS = 16
+STREAM_EDIT_INTERVAL = 1.2
+
 async def send_long_message(channel, message):
     for i in range(0, len(message), 2000):
         await channel.send(message[i:i+2000])
 
-def reword_prompt(prompt: str, max_tokens=80) -> str:
+async def send_streamed_message(channel, chunks):
+    """
+    Posts text from an async iterator of chunks as it arrives, editing the
+    message in place and continuing in a new message at the 2000-char limit.
+    Returns the full text.
+    """
+    loop = asyncio.get_running_loop()
+    parts = []
+    current_msg = None
+    current_text = ""
+    shown_text = ""
+    last_edit = 0.0
+
+    async def show(text):
+        nonlocal current_msg, shown_text, last_edit
+        if not text.strip() or text == shown_text:
+            return
+        if current_msg is None:
+            current_msg = await channel.send(text)
+        else:
+            await current_msg.edit(content=text)
+        shown_text = text
+        last_edit = loop.time()
+
+    async for chunk in chunks:
+        parts.append(chunk)
+        current_text += chunk
+        while len(current_text) > 2000:
+            await show(current_text[:2000])
+            current_text = current_text[2000:]
+            current_msg = None
+            shown_text = ""
+        if current_msg is None:
+            if len(current_text.strip()) >= STREAM_FIRST_CHARS:
+                await show(current_text)
+        elif loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+            await show(current_text)
+    await show(current_text)
+    return "".join(parts)
+
+def _reword_request(prompt, max_tokens):
     custom_system = (
         f"Reword the following prompt to be more descriptive and detailed, "
         f"while keeping it to approximately {max_tokens} tokens. Return only the reworded prompt."
     )
-    new_prompt = call_lmstudio(prompt + "\n\n" + custom_system)
+    return prompt + "\n\n" + custom_system
+
+def reword_prompt(prompt: str, max_tokens=80) -> str:
+    new_prompt = call_lmstudio(_reword_request(prompt, max_tokens), priority=PRIORITY_REWORD, cacheable=True)
+    return new_prompt.strip()
+
+async def reword_prompt_async(prompt: str, max_tokens=80) -> str:
+    new_prompt = await call_lmstudio_async(
+        _reword_request(prompt, max_tokens), priority=PRIORITY_REWORD, cacheable=True
+    )
     return new_prompt.strip()
 
 def read_whatsnew():
@@ -34,24 +95,12 @@ def read_whatsnew():
         return "Error: 'whatsnew.txt' could not be read."
 
 async def add_reaction_if_interesting(message: discord.Message):
-    import random
-    # Only proceed with a 10% chance.
-    if random.random() > 0.1:
-        return
     if len(message.content) < 5:
         return
-    prompt = (
-        f"Given the following message:\n\"{message.content}\"\n"
-        "Suggest one reaction emoji that best expresses an appropriate reaction to this message. "
-        "If the message is not interesting, reply with 'none'. Return only the emoji or 'none'."
-    )
-    reaction = await asyncio.to_thread(call_lmstudio, prompt)
-    reaction = reaction.strip()
-    if reaction.lower() != "none" and reaction:
-        try:
-            await message.add_reaction(reaction)
-        except Exception as e:
-            print(f"[DEBUG] Error adding reaction: {e}")
+    # A local score and a 10% draw pick the candidates; they are classified in
+    # batches and the reaction lands once the batch is answered.
+    reactions.consider(message)
+
 def get_member_info(member: discord.Member) -> str:
     status = str(member.status)
     activities = []
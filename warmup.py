@@ -0,0 +1,138 @@
+import time
+import datetime
+import threading
+from chode import comfyui, image_queue, lmstudio, llm_scheduler, workflows
+from chode.llm_scheduler import PRIORITY_BACKGROUND
+
+# Loading the chat model in LMStudio and the checkpoint in ComfyUI takes tens
+# of seconds, so both are exercised once at startup instead of on the first
+# user request. Keep-alives repeat the warmup while the bot is idle so the
+# models are not unloaded; they are off unless an interval is set.
+WARMUP_LMSTUDIO = True
+WARMUP_COMFYUI = True
+WARMUP_KEEPALIVE_INTERVAL = None    # Seconds between keep-alives, e.g. 20 * 60; None disables them.
+WARMUP_KEEPALIVE_HOURS = None       # Optional (start, end) local hours keep-alives are limited to, e.g. (1, 9).
+WARMUP_COMFYUI_TIMEOUT = 300        # Seconds to wait for the warmup image job.
+
+# Smallest job the default workflow can run: tiny latent, one sampling step,
+# and a preview node instead of SaveImage so nothing lands in the output folder.
+WARMUP_IMAGE_SIZE = 64
+WARMUP_IMAGE_STEPS = 1
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(name, seconds):
+    with _stats_lock:
+        entry = _stats.setdefault(name, {"runs": 0, "first_s": None, "last_s": None})
+        entry["runs"] += 1
+        if entry["first_s"] is None:
+            entry["first_s"] = round(seconds, 3)
+        entry["last_s"] = round(seconds, 3)
+
+def warm_lmstudio():
+    """Sends a tiny completion; returns its latency in seconds, or None if it failed."""
+    start = time.perf_counter()
+    reply = lmstudio.chat_completion("Reply with the single word: ok", system_message="You are a warmup probe.",
+                                     priority=PRIORITY_BACKGROUND)
+    elapsed = time.perf_counter() - start
+    if lmstudio.is_error_reply(reply):
+        print(f"[DEBUG] LMStudio warmup failed after {elapsed:.2f}s: {reply}")
+        return None
+    _record("lmstudio", elapsed)
+    return elapsed
+
+def warmup_workflow():
+    """Returns the default workflow cut down to the cheapest job that still loads every model."""
+    workflow = workflows.get_workflow()
+    values = {"prompt": "warmup", "steps": WARMUP_IMAGE_STEPS, "seed": 0}
+    if "width" in workflow.params and "height" in workflow.params:
+        values["width"] = values["height"] = WARMUP_IMAGE_SIZE
+    payload = workflow.build(**{k: v for k, v in values.items() if k in workflow.params})
+    for node_id, node in payload.items():
+        if node["class_type"] == "SaveImage":
+            inputs = {k: v for k, v in node["inputs"].items() if k != "filename_prefix"}
+            payload[node_id] = dict(node, class_type="PreviewImage", inputs=inputs)
+    return payload
+
+def warm_comfyui():
+    """Runs the minimal image job and waits for it; returns its latency in seconds, or None."""
+    start = time.perf_counter()
+    try:
+        comfyui.run_workflow_blocking(warmup_workflow(), timeout=WARMUP_COMFYUI_TIMEOUT)
+    except Exception as e:
+        print(f"[DEBUG] ComfyUI warmup failed after {time.perf_counter() - start:.2f}s: {e}")
+        return None
+    elapsed = time.perf_counter() - start
+    _record("comfyui", elapsed)
+    return elapsed
+
+def run_warmup():
+    """Warms every enabled backend twice, logging the cold and the warm latency."""
+    for name, enabled, warm in (("LMStudio", WARMUP_LMSTUDIO, warm_lmstudio),
+                                ("ComfyUI", WARMUP_COMFYUI, warm_comfyui)):
+        if not enabled:
+            continue
+        cold = warm()
+        if cold is None:
+            continue
+        hot = warm()
+        hot_text = f"{hot:.2f}s" if hot is not None else "failed"
+        print(f"[DEBUG] {name} warmup: cold {cold:.2f}s, warm {hot_text}")
+
+def run_keepalive():
+    """Pings every enabled backend once so idle models stay loaded."""
+    for name, enabled, warm in (("LMStudio", WARMUP_LMSTUDIO, warm_lmstudio),
+                                ("ComfyUI", WARMUP_COMFYUI, warm_comfyui)):
+        if enabled:
+            elapsed = warm()
+            if elapsed is not None:
+                print(f"[DEBUG] {name} keep-alive took {elapsed:.2f}s")
+
+def _in_keepalive_hours():
+    if WARMUP_KEEPALIVE_HOURS is None:
+        return True
+    start, end = WARMUP_KEEPALIVE_HOURS
+    hour = datetime.datetime.now().hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+def _jobs_started():
+    llm_jobs = sum(llm_scheduler.scheduler_stats().get("started", {}).values())
+    images = image_queue.image_queue_stats()
+    image_jobs = images.get("completed", 0) + images.get("failed", 0) + images.get("running", 0)
+    return llm_jobs + image_jobs
+
+def _images_running():
+    return image_queue.image_queue_stats().get("running", 0) > 0
+
+def _warmup_loop():
+    try:
+        run_warmup()
+    except Exception as e:
+        print(f"[DEBUG] Error during startup warmup: {e}")
+    if not WARMUP_KEEPALIVE_INTERVAL:
+        return
+    last_seen = _jobs_started()
+    while True:
+        time.sleep(WARMUP_KEEPALIVE_INTERVAL)
+        try:
+            seen = _jobs_started()
+            # Only ping when nothing used the models since the last check and no image job
+            # holds ComfyUI; a keep-alive would queue behind it.
+            if seen == last_seen and not _images_running() and _in_keepalive_hours():
+                run_keepalive()
+                seen = _jobs_started()
+            last_seen = seen
+        except Exception as e:
+            print(f"[DEBUG] Error during keep-alive warmup: {e}")
+
+def start_warmup_worker():
+    """Starts the background thread that warms the models at startup and, if enabled, keeps them loaded."""
+    thread = threading.Thread(target=_warmup_loop, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def warmup_stats():
+    """Returns warmup run counts and first (cold) and latest latencies per backend."""
+    with _stats_lock:
+        return {name: dict(entry) for name, entry in _stats.items()}
@@ -0,0 +1,197 @@
+import os
+import glob
+import json
+import time
+import random
+import threading
+
+# ComfyUI workflows (API-format JSON) are loaded and validated once, then
+# reloaded only when their file changes. flux.json is the default workflow;
+# any other *.json in WORKFLOW_DIR is registered under its file name, so tuned
+# workflows can be added without code changes.
+#
+# Named parameters map to (node_id, input) paths. They are found from the
+# graph: the sampler's seed and steps, the prompt and negative text encoders
+# wired to its positive and negative inputs, and the latent image's size. A
+# workflow can override or add paths with a "<name>.params.json" file next to
+# it, e.g. {"prompt": ["6", "text"], "steps": ["31", "steps"]}.
+DEFAULT_WORKFLOW = "flux"
+DEFAULT_WORKFLOW_PATH = "flux.json"
+WORKFLOW_DIR = "workflows"
+WORKFLOW_WATCH_INTERVAL = 10  # Seconds between checks for changed workflow files.
+
+PARAMETERS = ("prompt", "negative", "seed", "width", "height", "steps", "batch_size")
+SAMPLER_CLASSES = ("KSampler", "KSamplerAdvanced")
+
+class WorkflowError(Exception):
+    pass
+
+class Workflow:
+    """A validated workflow graph and where each named parameter lives in it."""
+
+    def __init__(self, name, path, graph, params, version):
+        self.name = name
+        self.path = path
+        self.graph = graph
+        self.params = params  # Key: parameter name, Value: (node_id, input name)
+        self.version = version
+
+    def build(self, **values):
+        """
+        Returns a job payload with the given parameters filled in. Only the
+        patched nodes are copied; every other node is shared with the template,
+        which ComfyUI never mutates. A missing seed gets a random one.
+        """
+        if "seed" in self.params and values.get("seed") is None:
+            values["seed"] = random.randint(0, 2**32 - 1)
+        payload = dict(self.graph)
+        for param, value in values.items():
+            if value is None:
+                continue
+            if param not in self.params:
+                raise WorkflowError(f"Workflow '{self.name}' has no '{param}' parameter.")
+            node_id, input_name = self.params[param]
+            if payload[node_id] is self.graph[node_id]:
+                node = self.graph[node_id]
+                payload[node_id] = dict(node, inputs=dict(node["inputs"]))
+            payload[node_id]["inputs"][input_name] = value
+        return payload
+
+def _linked_node(graph, node, input_name):
+    link = node["inputs"].get(input_name)
+    if isinstance(link, list) and link and link[0] in graph:
+        return link[0], graph[link[0]]
+    return None, None
+
+def find_params(graph):
+    """Derives parameter paths from the first sampler node in the graph."""
+    params = {}
+    sampler_id = next((node_id for node_id, node in graph.items() if node["class_type"] in SAMPLER_CLASSES), None)
+    if sampler_id is None:
+        return params
+    sampler = graph[sampler_id]
+    for param, input_name in (("seed", "seed"), ("steps", "steps")):
+        if input_name in sampler["inputs"]:
+            params[param] = (sampler_id, input_name)
+    for param, input_name in (("prompt", "positive"), ("negative", "negative")):
+        node_id, node = _linked_node(graph, sampler, input_name)
+        if node is not None and "text" in node["inputs"]:
+            params[param] = (node_id, "text")
+    node_id, node = _linked_node(graph, sampler, "latent_image")
+    if node is not None:
+        for param in ("width", "height", "batch_size"):
+            if param in node["inputs"]:
+                params[param] = (node_id, param)
+    return params
+
+def validate(name, graph, params):
+    """Raises WorkflowError unless the graph is well formed and every parameter path exists."""
+    if not isinstance(graph, dict) or not graph:
+        raise WorkflowError(f"Workflow '{name}' is not a non-empty JSON object of nodes.")
+    for node_id, node in graph.items():
+        if not isinstance(node, dict) or "class_type" not in node or not isinstance(node.get("inputs"), dict):
+            raise WorkflowError(f"Workflow '{name}' node '{node_id}' needs a class_type and inputs.")
+        for input_name, value in node["inputs"].items():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and value[0] not in graph:
+                raise WorkflowError(f"Workflow '{name}' node '{node_id}' input '{input_name}' links to missing node '{value[0]}'.")
+    if "prompt" not in params:
+        raise WorkflowError(f"Workflow '{name}' has no prompt parameter.")
+    for param, (node_id, input_name) in params.items():
+        if node_id not in graph or input_name not in graph[node_id]["inputs"]:
+            raise WorkflowError(f"Workflow '{name}' parameter '{param}' points to missing input {node_id}.{input_name}.")
+
+def load_workflow(name, path):
+    with open(path, "r") as f:
+        graph = json.load(f)
+    params = find_params(graph) if isinstance(graph, dict) else {}
+    params_path = os.path.splitext(path)[0] + ".params.json"
+    if os.path.exists(params_path):
+        with open(params_path, "r") as f:
+            params.update({param: tuple(node_path) for param, node_path in json.load(f).items()})
+    validate(name, graph, params)
+    return Workflow(name, path, graph, params, _version(path))
+
+def _version(path):
+    params_path = os.path.splitext(path)[0] + ".params.json"
+    params_version = os.stat(params_path).st_mtime_ns if os.path.exists(params_path) else 0
+    return (os.stat(path).st_mtime_ns, params_version)
+
+def _workflow_paths():
+    paths = {}
+    if os.path.exists(DEFAULT_WORKFLOW_PATH):
+        paths[DEFAULT_WORKFLOW] = DEFAULT_WORKFLOW_PATH
+    for path in sorted(glob.glob(os.path.join(WORKFLOW_DIR, "*.json"))):
+        if not path.endswith(".params.json"):
+            paths.setdefault(os.path.basename(path)[:-len(".json")], path)
+    return paths
+
+_registry = {}  # Key: workflow name, Value: Workflow
+_registry_lock = threading.Lock()
+_failed = {}  # Key: path, Value: version that failed to load, so it is reported once
+_stats = {"loads": 0, "load_errors": 0, "builds": 0}
+
+def refresh_workflows():
+    """Loads new or changed workflow files and forgets deleted ones. A file that fails validation keeps its last good version."""
+    paths = _workflow_paths()
+    for name, path in paths.items():
+        current = _registry.get(name)
+        version = None
+        try:
+            version = _version(path)
+            if current is not None and current.path == path and current.version == version:
+                continue
+            if _failed.get(path) == version:
+                continue
+            workflow = load_workflow(name, path)
+        except Exception as e:
+            _stats["load_errors"] += 1
+            _failed[path] = version
+            print(f"[DEBUG] Could not load workflow '{name}' from {path}: {e}")
+            continue
+        _failed.pop(path, None)
+        with _registry_lock:
+            _registry[name] = workflow
+        _stats["loads"] += 1
+        print(f"[DEBUG] Loaded workflow '{name}' from {path} with parameters {sorted(workflow.params)}")
+    with _registry_lock:
+        for name in list(_registry):
+            if name not in paths:
+                del _registry[name]
+
+def get_workflow(name=None):
+    workflow = _registry.get(name or DEFAULT_WORKFLOW)
+    if workflow is None:
+        raise WorkflowError(f"Workflow '{name or DEFAULT_WORKFLOW}' is not loaded.")
+    return workflow
+
+def build(name=None, **values):
+    """Builds a job payload from the named workflow (the default one if None)."""
+    payload = get_workflow(name).build(**values)
+    _stats["builds"] += 1
+    return payload
+
+def workflow_names():
+    return sorted(_registry)
+
+def _watch_loop():
+    while True:
+        time.sleep(WORKFLOW_WATCH_INTERVAL)
+        try:
+            refresh_workflows()
+        except Exception as e:
+            print(f"[DEBUG] Error refreshing workflows: {e}")
+
+def start_workflow_watcher():
+    """Starts the background thread that reloads workflow files when they change."""
+    thread = threading.Thread(target=_watch_loop, name="workflow-watcher", daemon=True)
+    thread.start()
+    return thread
+
+def workflow_stats():
+    """Returns the loaded workflows with their parameters, and load and build counts."""
+    return {
+        "workflows": {name: sorted(workflow.params) for name, workflow in _registry.items()},
+        **_stats,
+    }
+
+refresh_workflows()